@@ -0,0 +1,161 @@
+"""
+Reproducible benchmark for the DICOM backend.
+
+Generates a synthetic study, ingests it with build_metadata_json and times the
+hot endpoints through an in-process TestClient. Results are written as JSON so
+runs can be compared across releases:
+
+    python benchmark.py --slices 128 --rows 512 --transfer-syntax jpeg2000 -o bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+import pydicom
+
+BENCHMARK_VERSION = 1
+
+def latency_stats(samples):
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "n": int(ms.size),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+def time_requests(client, urls, params=None):
+    samples = []
+    for url in urls:
+        start = time.perf_counter()
+        resp = client.get(url, params=params)
+        if resp.status_code != 200:
+            raise RuntimeError(f"GET {url} -> {resp.status_code}: {resp.text[:200]}")
+        resp.read()
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+def run_benchmark(args):
+    # main resolves uploads/ and the catalog relative to the cwd, so import it
+    # from inside the scratch workspace.
+    os.chdir(args.workdir)
+    os.environ["DICOM_CATALOG"] = os.path.join(args.workdir, "catalog.sqlite3")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    from fastapi.testclient import TestClient
+    from synth_dicom import write_synthetic_study
+
+    study_id = main.allocate_study_id()
+    study_dir = main.get_study_dir(study_id)
+    start = time.perf_counter()
+    paths = write_synthetic_study(
+        study_dir, slices=args.slices, rows=args.rows, cols=args.cols, bits=args.bits,
+        transfer_syntax=args.transfer_syntax, multiframe=args.multiframe, seed=args.seed,
+    )
+    generate_s = time.perf_counter() - start
+    input_bytes = sum(os.path.getsize(p) for p in paths)
+
+    start = time.perf_counter()
+    meta_json = main.build_metadata_json(study_id, study_dir)
+    ingest_s = time.perf_counter() - start
+    images = [img for series in meta_json["series"] for img in series["images"]]
+    results = {
+        "generate": {"seconds": round(generate_s, 3), "files": len(paths), "bytes": input_bytes},
+        "ingest": {
+            "seconds": round(ingest_s, 3),
+            "files_per_s": round(len(paths) / ingest_s, 2),
+            "images_per_s": round(len(images) / ingest_s, 2),
+            "mb_per_s": round(input_bytes / ingest_s / main.MB, 2),
+            "images": len(images),
+        },
+    }
+    if main.ingest_pool is not None:
+        main.ingest_pool.shutdown()
+
+    client = TestClient(main.app)
+    results["list_studies"] = time_requests(client, ["/studies"] * args.requests)
+    if not images:
+        # Nothing renderable (e.g. a syntax the backend can't decode yet)
+        return results
+    image_urls = [
+        f"/studies/{study_id}/series/{series['series_id']}/image/{img['image_id']}"
+        for series in meta_json["series"] for img in series["images"]
+    ]
+    passes = max(1, args.requests // max(len(image_urls), 1))
+    main.evict_study_caches(study_id)
+    results["get_series_image"] = {
+        "cold": time_requests(client, image_urls),
+        "cached": time_requests(client, image_urls * passes),
+    }
+    main.evict_study_caches(study_id)
+    results["get_series_image"]["windowed"] = time_requests(client, image_urls, {"window": 1500, "level": 300})
+
+    series_id = meta_json["series"][0]["series_id"]
+    for fmt in args.export_formats:
+        results[f"export_series_{fmt}"] = time_requests(
+            client, [f"/studies/{study_id}/series/{series_id}/export/file?format={fmt}"] * args.export_repeats,
+        )
+        results[f"export_study_{fmt}"] = time_requests(
+            client, [f"/studies/{study_id}/export/file?format={fmt}"] * args.export_repeats,
+        )
+    return results
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--slices", type=int, default=64)
+    parser.add_argument("--rows", type=int, default=512)
+    parser.add_argument("--cols", type=int, default=512)
+    parser.add_argument("--bits", type=int, choices=(8, 12, 16), default=16)
+    parser.add_argument("--transfer-syntax", choices=("uncompressed", "jpeg", "jpeg2000", "rle"), default="uncompressed")
+    parser.add_argument("--multiframe", action="store_true")
+    parser.add_argument("--requests", type=int, default=200, help="requests per latency scenario")
+    parser.add_argument("--export-formats", nargs="*", default=["jpeg", "dicom"])
+    parser.add_argument("--export-repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="scratch dir for uploads/catalog (default: a temp dir, removed after)")
+    parser.add_argument("-o", "--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    if args.transfer_syntax == "jpeg" and args.bits != 8:
+        parser.error("--transfer-syntax jpeg (baseline) needs --bits 8")
+
+    cleanup = args.workdir is None
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="dicom-bench-"))
+    os.makedirs(args.workdir, exist_ok=True)
+    output = os.path.abspath(args.output) if args.output else None
+    config = {k: v for k, v in vars(args).items() if k not in ("workdir", "output")}
+    try:
+        results = run_benchmark(args)
+    finally:
+        if cleanup:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+    report = {
+        "benchmark_version": BENCHMARK_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pydicom": pydicom.__version__,
+        },
+        "config": config,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main_cli()
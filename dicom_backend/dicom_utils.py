@@ -1,29 +1,560 @@
-import pydicom
+import hashlib
+import io
+import itertools
+import os
+import struct
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
-def parse_dicom_folder(folder: Path):
-    """
-    Parse all DICOM files in a folder and extract metadata.
-    """
-    studies = []
-    for f in folder.glob("**/*.dcm"):
-        ds = pydicom.dcmread(f)
-        info = {
-            "filename": str(f),
-            "patient_name": str(ds.get("PatientName", "")),
-            "study_date": ds.get("StudyDate", ""),
-            "series_description": ds.get("SeriesDescription", ""),
-            "window_center": ds.get("WindowCenter", None),
-            "window_width": ds.get("WindowWidth", None),
-            "pixel_spacing": ds.get("PixelSpacing", None),
-            "rows": ds.get("Rows", None),
-            "columns": ds.get("Columns", None),
+import numpy as np
+import pydicom
+from PIL import Image
+from pydicom.dataset import FileMetaDataset
+from pydicom.encaps import get_frame
+from pydicom.multival import MultiValue
+from pydicom.pixels import iter_pixels, pixel_array
+from pydicom.uid import (
+    ExplicitVRBigEndian, ExplicitVRLittleEndian, ImplicitVRLittleEndian, JPEGBaseline8Bit, JPEGExtended12Bit,
+)
+
+DEFAULT_WINDOW = 2000
+DEFAULT_LEVEL = 1000
+SCAN_WORKERS = int(os.environ.get("DICOM_SCAN_WORKERS", 8))
+# Encapsulated frames a browser can display as stored (8-bit baseline JPEG)
+PASSTHROUGH_SYNTAXES = {JPEGBaseline8Bit, JPEGExtended12Bit}
+PASSTHROUGH_PHOTOMETRICS = {"MONOCHROME2", "RGB", "YBR_FULL", "YBR_FULL_422"}
+DICOMDIR_NAME = "DICOMDIR"
+# Explicit VR codes, for sniffing datasets written without the preamble
+VR_CODES = {
+    b"AE", b"AS", b"AT", b"CS", b"DA", b"DS", b"DT", b"FL", b"FD", b"IS", b"LO", b"LT", b"OB", b"OD",
+    b"OF", b"OL", b"OV", b"OW", b"PN", b"SH", b"SL", b"SQ", b"SS", b"ST", b"SV", b"TM", b"UC", b"UI",
+    b"UL", b"UN", b"UR", b"US", b"UT", b"UV",
+}
+# Large values (pixel data) stay on disk until a frame is actually needed
+DEFER_SIZE = "1 MB"
+# Enhanced multi-frame objects keep these per frame (or shared) in functional groups
+FRAME_MACROS = {
+    "PixelSpacing": "PixelMeasuresSequence",
+    "SliceThickness": "PixelMeasuresSequence",
+    "ImagePositionPatient": "PlanePositionSequence",
+    "ImageOrientationPatient": "PlaneOrientationSequence",
+    "WindowCenter": "FrameVOILUTSequence",
+    "WindowWidth": "FrameVOILUTSequence",
+    "RescaleSlope": "PixelValueTransformationSequence",
+    "RescaleIntercept": "PixelValueTransformationSequence",
+}
+HEADER_TAGS = [
+    "PatientName", "StudyDate", "SeriesDescription", "WindowCenter", "WindowWidth",
+    "PixelSpacing", "Rows", "Columns",
+]
+
+def read_dataset(path, **kwargs):
+    """
+    dcmread that also takes bare datasets (no preamble or file meta), filling
+    in the transfer syntax from the encoding pydicom detected while parsing.
+    """
+    ds = pydicom.dcmread(path, force=True, **kwargs)
+    meta = getattr(ds, "file_meta", None)
+    if meta is None:
+        meta = ds.file_meta = FileMetaDataset()
+    if "TransferSyntaxUID" not in meta and ds.original_encoding[0] is not None:
+        implicit, little = ds.original_encoding
+        if implicit:
+            meta.TransferSyntaxUID = ImplicitVRLittleEndian
+        else:
+            meta.TransferSyntaxUID = ExplicitVRLittleEndian if little else ExplicitVRBigEndian
+    return ds
+
+def first_value(value, default):
+    """
+    Return the first element of a (possibly multi-valued) numeric tag as float.
+    """
+    if value is None:
+        return default
+    if isinstance(value, (list, tuple, MultiValue)):
+        value = value[0] if len(value) else None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def frame_count(ds):
+    return int(ds.get("NumberOfFrames", 1) or 1)
+
+def frame_value(ds, keyword, frame=None, default=None):
+    """
+    Header value for one frame: the per-frame functional group, then the
+    shared one, then the plain top-level attribute.
+    """
+    macro = FRAME_MACROS.get(keyword)
+    if macro:
+        groups = []
+        per_frame = ds.get("PerFrameFunctionalGroupsSequence")
+        if per_frame and (frame or 0) < len(per_frame):
+            groups.append(per_frame[frame or 0])
+        shared = ds.get("SharedFunctionalGroupsSequence")
+        if shared:
+            groups.append(shared[0])
+        for group in groups:
+            items = group.get(macro)
+            if items and keyword in items[0]:
+                return items[0].get(keyword)
+    return ds.get(keyword, default)
+
+def dataset_window(ds, frame=None):
+    """
+    Return the dataset's own (window, level), falling back to the defaults.
+    """
+    return (
+        first_value(frame_value(ds, "WindowWidth", frame), DEFAULT_WINDOW),
+        first_value(frame_value(ds, "WindowCenter", frame), DEFAULT_LEVEL),
+    )
+
+def rescale(arr, slope, intercept):
+    if slope == 1 and intercept.is_integer():
+        arr = arr.astype(np.int32) + int(intercept)
+    else:
+        arr = arr.astype(np.float32) * slope + intercept
+    return np.clip(arr, -32768, 32767).astype(np.int16)
+
+def frame_rescale(ds, frame=None):
+    return (
+        float(frame_value(ds, "RescaleSlope", frame, 1) or 1),
+        float(frame_value(ds, "RescaleIntercept", frame, 0) or 0),
+    )
+
+def stored_pixels(ds, frame=None):
+    """
+    Stored pixel values; for one frame of a multi-frame object only that
+    frame is read from disk and decoded.
+    """
+    if frame is None or frame_count(ds) <= 1:
+        return ds.pixel_array
+    return pixel_array(ds.filename, index=frame)
+
+def rescaled_pixels(ds, frame=None):
+    """
+    Decode pixel data and apply RescaleSlope/RescaleIntercept into int16.
+    """
+    return rescale(stored_pixels(ds, frame), *frame_rescale(ds, frame))
+
+def read_frame_pixels(path, frame=None):
+    return rescaled_pixels(read_dataset(path, defer_size=DEFER_SIZE), frame)
+
+@lru_cache(maxsize=256)
+def window_lut(window, level):
+    """
+    Window/level lookup table indexed by the uint16 bit pattern of an int16
+    pixel, so windowing a slice is one table lookup with no float math.
+    """
+    values = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.float32)
+    w = max(float(window), 1.0)
+    l = float(level)
+    lut = np.clip((values - (l - 0.5)) / (w - 1 if w > 1 else 1) + 0.5, 0, 1) * 255
+    lut = lut.astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+def apply_window(arr, window, level):
+    return window_lut(float(window), float(level))[arr.view(np.uint16)]
+
+def encode_jpeg(arr, quality=None):
+    buf = io.BytesIO()
+    if quality:
+        Image.fromarray(arr).save(buf, format="JPEG", quality=int(quality))
+    else:
+        Image.fromarray(arr).save(buf, format="JPEG")
+    return buf.getvalue()
+
+def render_dataset_array(ds, window=None, level=None, frame=None, pixels=None):
+    """
+    Render an already-read dataset (or one frame of it) to uint8 at the given
+    or dataset W/L. pixels skips the decode when the frame is already rescaled.
+    """
+    ds_window, ds_level = dataset_window(ds, frame)
+    if window is None:
+        window = ds_window
+    if level is None:
+        level = ds_level
+    if pixels is None:
+        pixels = rescaled_pixels(ds, frame)
+    return apply_window(pixels, window, level)
+
+def passthrough_compatible(ds, frame=None):
+    """
+    True when the stored JPEG frames already are the default rendering:
+    8-bit unsigned baseline, no rescale and no header window narrower than 0..255.
+    """
+    if ds.file_meta.get("TransferSyntaxUID") not in PASSTHROUGH_SYNTAXES or "PixelData" not in ds:
+        return False
+    if ds.get("BitsStored") != 8 or ds.get("PixelRepresentation", 0) != 0:
+        return False
+    if ds.get("PhotometricInterpretation") not in PASSTHROUGH_PHOTOMETRICS:
+        return False
+    if frame_rescale(ds, frame) != (1, 0):
+        return False
+    if frame_value(ds, "WindowWidth", frame) is not None:
+        window, level = dataset_window(ds, frame)
+        if level - 0.5 - (window - 1) / 2 > 0 or level - 0.5 + (window - 1) / 2 < 255:
+            return False
+    return True
+
+def passthrough_jpeg_frame(ds, frame=None):
+    """
+    Stored JPEG bytes of one frame, located through the (extended) Basic
+    Offset Table without decoding; None if the dataset must be rendered.
+    Deferred pixel data is read from the file, that frame only.
+    """
+    if not passthrough_compatible(ds, frame):
+        return None
+    extended = None
+    if "ExtendedOffsetTable" in ds and "ExtendedOffsetTableLengths" in ds:
+        extended = (ds.ExtendedOffsetTable, ds.ExtendedOffsetTableLengths)
+    try:
+        elem = ds.get_item("PixelData", keep_deferred=True)
+        kwargs = {"extended_offsets": extended, "number_of_frames": frame_count(ds)}
+        if getattr(elem, "value", None) is None and getattr(elem, "value_tell", None) is not None:
+            with open(ds.filename, "rb") as f:
+                f.seek(elem.value_tell)
+                data = get_frame(f, frame or 0, **kwargs)
+        else:
+            data = get_frame(ds.PixelData, frame or 0, **kwargs)
+    except Exception:
+        return None
+    return data if data[:2] == b"\xff\xd8" else None
+
+def jpeg_pyramid_array(jpeg_bytes, sizes):
+    """
+    Decode a JPEG just large enough for the biggest pyramid level, letting
+    libjpeg downscale in the DCT domain; returns (array, native_size).
+    """
+    img = Image.open(io.BytesIO(jpeg_bytes))
+    native = max(img.size)
+    largest = max((s for s in sizes if s < native), default=None)
+    if largest is None:
+        return None, native
+    img.draft(img.mode, (largest, largest))
+    return np.asarray(img.convert("L" if img.mode == "L" else "RGB")), native
+
+def render_dataset_jpeg(ds, window=None, level=None, frame=None):
+    if window is None and level is None:
+        data = passthrough_jpeg_frame(ds, frame)
+        if data is not None:
+            return data
+    return encode_jpeg(render_dataset_array(ds, window, level, frame))
+
+def write_file_atomic(path, data):
+    # Temp name unique per process and thread: concurrent writers of the same
+    # file (two requests backfilling a level, two workers) each rename their own
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def pyramid_filename(jpeg_filename, size):
+    return os.path.join(f"s{size}", jpeg_filename)
+
+def render_pyramid(arr, sizes, native=None):
+    """
+    Yield (size, jpeg_bytes) for each pyramid level smaller than the image,
+    largest first, each level downsampled from the previous one. native is
+    the full image size when arr has already been reduced.
+    """
+    img = Image.fromarray(arr)
+    native = native or max(img.size)
+    for size in sorted(sizes, reverse=True):
+        if native <= size:
+            continue
+        img = img.copy()
+        img.thumbnail((size, size), Image.BILINEAR)
+        yield size, encode_jpeg(np.asarray(img))
+
+def write_pyramid(arr, jpeg_dir, jpeg_filename, sizes, native=None):
+    for size, data in render_pyramid(arr, sizes, native):
+        path = os.path.join(jpeg_dir, pyramid_filename(jpeg_filename, size))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file_atomic(path, data)
+
+def frame_jpeg_filename(series_uid, sop_uid, frame=None):
+    if frame is None:
+        return f"{series_uid}_{sop_uid}.jpg"
+    return f"{series_uid}_{sop_uid}_f{frame}.jpg"
+
+def image_record(ds, fname, sop_uid, jpeg_filename, frame=None):
+    px_spacing = frame_value(ds, "PixelSpacing", frame) or [1.0, 1.0]
+    window_width, window_center = dataset_window(ds, frame)
+    record = {
+        "image_id": sop_uid if frame is None else f"{sop_uid}_f{frame}",
+        "filename": fname,
+        "jpeg_filename": jpeg_filename,
+        "instanceNumber": int(getattr(ds, "InstanceNumber", 0) or 0),
+        "pixelSpacingX": float(px_spacing[1]) if len(px_spacing) > 1 else float(px_spacing[0]),
+        "pixelSpacingY": float(px_spacing[0]),
+        "Columns": int(getattr(ds, "Columns", 512)),
+        "Rows": int(getattr(ds, "Rows", 512)),
+        "WindowCenter": window_center,
+        "WindowWidth": window_width,
+    }
+    if frame is not None:
+        record.update(sopInstanceUID=sop_uid, frame=frame, numberOfFrames=frame_count(ds))
+    return record
+
+def write_frame_jpeg(ds, frame, jpeg_dir, jpeg_filename, pyramid_sizes, pixels=None):
+    """
+    Write one frame's default JPEG and pyramid; returns the JPEG bytes.
+    """
+    jpeg_bytes = passthrough_jpeg_frame(ds, frame)
+    if jpeg_bytes is not None:
+        # Stored frame is served as-is; no pixel decode at all
+        write_file_atomic(os.path.join(jpeg_dir, jpeg_filename), jpeg_bytes)
+        arr, native = jpeg_pyramid_array(jpeg_bytes, pyramid_sizes)
+        if arr is not None:
+            write_pyramid(arr, jpeg_dir, jpeg_filename, pyramid_sizes, native)
+        return jpeg_bytes
+    arr = render_dataset_array(ds, frame=frame, pixels=pixels)
+    jpeg_bytes = encode_jpeg(arr)
+    write_file_atomic(os.path.join(jpeg_dir, jpeg_filename), jpeg_bytes)
+    write_pyramid(arr, jpeg_dir, jpeg_filename, pyramid_sizes)
+    return jpeg_bytes
+
+def write_multiframe_jpegs(ds, frames, jpeg_dir, images, pyramid_sizes):
+    # Frames are decoded one at a time in file order; the whole pixel
+    # volume is never held in memory.
+    if passthrough_compatible(ds):
+        for frame in frames:
+            write_frame_jpeg(ds, frame, jpeg_dir, images[frame]["jpeg_filename"], pyramid_sizes)
+        return
+    for frame, stored in zip(frames, iter_pixels(ds.filename, indices=frames)):
+        pixels = rescale(stored, *frame_rescale(ds, frame))
+        write_frame_jpeg(ds, frame, jpeg_dir, images[frame]["jpeg_filename"], pyramid_sizes, pixels)
+
+def convert_dicom_file(fpath, study_dir, jpeg_dir, pyramid_sizes=()):
+    """
+    Single-pass ingest of one file: read it once, render the JPEG (plus its
+    downsampled pyramid levels) if it is not already on disk and return the
+    header record. Multi-frame objects yield one image per frame. Top-level
+    so it can run in a process pool; returns None for unreadable files.
+    """
+    fname = os.path.relpath(fpath, study_dir)
+    try:
+        ds = read_dataset(fpath, defer_size=DEFER_SIZE)
+        series_uid = getattr(ds, "SeriesInstanceUID", None)
+        sop_uid = getattr(ds, "SOPInstanceUID", None)
+        if not series_uid:
+            series_uid = "SERIES_" + hashlib.md5(fname.encode()).hexdigest()
+        if not sop_uid:
+            sop_uid = "IMG_" + hashlib.md5(fname.encode()).hexdigest()
+        n_frames = frame_count(ds)
+        frames = [None] if n_frames <= 1 else list(range(n_frames))
+        images = [
+            image_record(ds, fname, sop_uid, frame_jpeg_filename(series_uid, sop_uid, frame), frame)
+            for frame in frames
+        ]
+        missing = [
+            frame for frame, image in zip(frames, images)
+            if not os.path.exists(os.path.join(jpeg_dir, image["jpeg_filename"]))
+        ]
+        jpeg_bytes = None
+        if missing == [None]:
+            jpeg_bytes = write_frame_jpeg(ds, None, jpeg_dir, images[0]["jpeg_filename"], pyramid_sizes)
+        elif missing:
+            write_multiframe_jpegs(ds, missing, jpeg_dir, images, pyramid_sizes)
+        return {
+            "series_uid": series_uid,
+            "series_description": str(getattr(ds, "SeriesDescription", "Series")),
+            "study": {
+                "patientName": str(ds.get("PatientName", "Unknown")),
+                "studyDate": str(ds.get("StudyDate", "Unknown")),
+                "description": str(ds.get("StudyDescription", "No Description")),
+                "studyInstanceUID": str(ds.get("StudyInstanceUID", "")),
+            },
+            "images": images,
+            # Only single-frame JPEGs are handed back for the cache; a
+            # multi-frame object could be thousands of frames.
+            "jpeg_bytes": jpeg_bytes,
         }
-        studies.append(info)
-    return studies
+    except Exception:
+        return None
+
+def is_dicom_file(path):
+    """
+    Sniff content rather than the extension: 128-byte preamble + "DICM", or a
+    bare dataset opening with a group 0002/0008 element in either VR encoding.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(132)
+    except OSError:
+        return False
+    if len(head) == 132 and head[128:] == b"DICM":
+        return True
+    if len(head) < 8:
+        return False
+    group, element = struct.unpack("<HH", head[:4])
+    if group not in (0x0002, 0x0008) or element > 0x00FF:
+        return False
+    if head[4:6] in VR_CODES:
+        return True
+    # Implicit VR little endian: a 4-byte even value length follows the tag
+    length = struct.unpack("<I", head[4:8])[0]
+    return length % 2 == 0 and length < 1024
+
+def dicomdir_files(dicomdir_path):
+    """
+    Files referenced by a DICOMDIR index, resolved relative to its folder.
+    """
+    base = os.path.dirname(dicomdir_path)
+    try:
+        ds = pydicom.dcmread(dicomdir_path, stop_before_pixels=True, force=True)
+    except Exception:
+        return []
+    paths = []
+    for record in ds.get("DirectoryRecordSequence", []):
+        file_id = record.get("ReferencedFileID")
+        if file_id:
+            parts = [file_id] if isinstance(file_id, str) else list(file_id)
+            paths.append(os.path.join(base, *parts))
+    return paths
+
+def _find_dicomdirs(root):
+    # Exports put DICOMDIR at the top, or one level down inside a zip
+    found = []
+    with os.scandir(root) as it:
+        folders = [root] + [e.path for e in it if e.is_dir(follow_symlinks=False)]
+    for folder in folders:
+        with os.scandir(folder) as it:
+            found += [e.path for e in it if e.name.upper() == DICOMDIR_NAME and e.is_file()]
+    return found
+
+def _walk_files(root, skip=(), covered=()):
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            it = os.scandir(folder)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name in skip:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.path not in covered:
+                        stack.append(entry.path)
+                elif entry.is_file() and entry.name.upper() != DICOMDIR_NAME:
+                    yield entry.path
+
+def _bounded_map(func, items, max_workers):
+    # (item, result) pairs in completion order, with at most 4x workers queued
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+    try:
+        for item in items:
+            pending[pool.submit(func, item)] = item
+            if len(pending) < max_workers * 4:
+                continue
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+def find_dicom_files(root, skip=(), max_workers=SCAN_WORKERS):
+    """
+    Yield DICOM file paths under root, whatever their names. Folders indexed
+    by a DICOMDIR are taken from the index instead of being walked; everything
+    else is walked with os.scandir and sniffed in parallel. Names in skip are
+    ignored at any depth.
+    """
+    root = str(root)
+    indexed, covered = [], set()
+    for dicomdir in _find_dicomdirs(root):
+        paths = dicomdir_files(dicomdir)
+        if paths:
+            indexed += paths
+            covered.add(os.path.dirname(dicomdir))
+    if root in covered:
+        candidates = iter(indexed)
+    else:
+        candidates = itertools.chain(indexed, _walk_files(root, skip, covered))
+    for path, ok in _bounded_map(is_dicom_file, candidates, max_workers):
+        if ok:
+            yield path
+
+def read_header_info(path):
+    """
+    Read just HEADER_TAGS from one file; None if it isn't readable DICOM.
+    """
+    try:
+        ds = pydicom.dcmread(path, stop_before_pixels=True, specific_tags=HEADER_TAGS, defer_size="1 KB", force=True)
+    except Exception:
+        return None
+    return {
+        "filename": str(path),
+        "patient_name": str(ds.get("PatientName", "")),
+        "study_date": ds.get("StudyDate", ""),
+        "series_description": ds.get("SeriesDescription", ""),
+        "window_center": ds.get("WindowCenter", None),
+        "window_width": ds.get("WindowWidth", None),
+        "pixel_spacing": ds.get("PixelSpacing", None),
+        "rows": ds.get("Rows", None),
+        "columns": ds.get("Columns", None),
+    }
+
+def read_instance_uids(path):
+    """
+    (StudyInstanceUID, SOPInstanceUID) of one file, "" where missing; None
+    if it isn't readable DICOM.
+    """
+    try:
+        ds = pydicom.dcmread(
+            path, stop_before_pixels=True, specific_tags=["StudyInstanceUID", "SOPInstanceUID"], force=True,
+        )
+    except Exception:
+        return None
+    return str(ds.get("StudyInstanceUID", "")), str(ds.get("SOPInstanceUID", ""))
+
+def scan_instance_uids(paths, max_workers=SCAN_WORKERS):
+    """
+    Yield (path, study_uid, sop_uid) for each readable file, in completion order.
+    """
+    for path, uids in _bounded_map(read_instance_uids, paths, max_workers):
+        if uids is not None:
+            yield (path,) + uids
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def parse_dicom_folder(folder: Path, max_workers=SCAN_WORKERS):
+    """
+    Yield header metadata for each DICOM in a folder, in completion order.
+    Reads fan out over a thread pool with a bounded number in flight, so
+    memory stays flat however many files the folder holds.
+    """
+    paths = find_dicom_files(folder, max_workers=max_workers)
+    for _, info in _bounded_map(read_header_info, paths, max_workers):
+        if info is not None:
+            yield info
 
 def get_study_metadata(folder: Path):
     """
     Return parsed study/series/image structure for the frontend.
     """
-    return parse_dicom_folder(folder)
\ No newline at end of file
+    return list(parse_dicom_folder(folder))
\ No newline at end of file
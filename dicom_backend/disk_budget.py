@@ -0,0 +1,94 @@
+import os
+import shutil
+import time
+
+# Suffixes of files written to a temp name and renamed into place; any still
+# around after TEMP_MAX_AGE belong to a writer that died.
+TEMP_SUFFIXES = (".tmp", ".tmp.mp4")
+
+def dir_size(path):
+    """
+    Total bytes of regular files under path (0 if it does not exist).
+    """
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+    return total
+
+def remove_file(path):
+    """
+    Delete one file; returns the bytes freed (0 if it was already gone).
+    """
+    try:
+        size = os.stat(path).st_size
+        os.remove(path)
+        return size
+    except OSError:
+        return 0
+
+def remove_tree(path):
+    size = dir_size(path)
+    shutil.rmtree(path, ignore_errors=True)
+    return size - dir_size(path)
+
+def remove_stale_file(path, max_age, now=None):
+    """
+    Delete path if it has not been touched for max_age seconds; returns the
+    bytes freed.
+    """
+    now = time.time() if now is None else now
+    try:
+        if now - os.stat(path).st_mtime < max_age:
+            return 0
+    except OSError:
+        return 0
+    return remove_file(path)
+
+def sweep_temp_files(root, max_age, now=None):
+    """
+    Remove temp files under root not touched for max_age seconds; returns
+    (files_removed, bytes_freed). Only point this at directories of derived
+    data: uploads are found by content, so a source file may end in .tmp.
+    """
+    now = time.time() if now is None else now
+    removed = freed = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            if not name.endswith(TEMP_SUFFIXES):
+                continue
+            size = remove_stale_file(os.path.join(dirpath, name), max_age, now)
+            if size:
+                removed += 1
+                freed += size
+    return removed, freed
+
+def evict_lru(units, needed, on_evict=None):
+    """
+    Remove units ({"path", "bytes", "rank", ...}) lowest rank first until
+    needed bytes are freed. on_evict(unit) runs before each removal and may
+    return False to keep that unit. Returns (units_evicted, bytes_freed).
+    """
+    evicted = freed = 0
+    for unit in sorted(units, key=lambda u: u["rank"]):
+        if freed >= needed:
+            break
+        if on_evict is not None and on_evict(unit) is False:
+            continue
+        size = remove_tree(unit["path"]) if os.path.isdir(unit["path"]) else remove_file(unit["path"])
+        if size:
+            evicted += 1
+            freed += size
+    return evicted, freed
@@ -1,5 +1,5 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Query, Form, status
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Request, Query, Form, status
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 import os
 import shutil
@@ -7,19 +7,53 @@ import pydicom
 import numpy as np
 from typing import List, Dict, Any
 from PIL import Image
+import copy
 import io
 import hashlib
 import json
 from cachetools import LRUCache
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import logging
+from starlette.concurrency import run_in_threadpool
 import threading
-import tempfile
+import time
 import re
 import zipfile
+import sqlite3
+import fcntl
+from contextlib import contextmanager
 import SimpleITK as sitk
+from metrics import stage_timer, timed, timed_iter, request_stages, render_metrics, server_timing, inc_counter, submit_tracked, executor_load
+from render_cache import make_render_cache
+from series_pack import SeriesPack, index_path, write_pack, stale_pack_files
+from disk_budget import dir_size, remove_file, remove_stale_file, sweep_temp_files, evict_lru
+from zip_stream import plan_stored_zip, stored_zip_size, stored_zip_etag, iter_stored_zip, iter_byte_range
+from dicom_utils import (
+    DEFAULT_WINDOW,
+    DEFAULT_LEVEL,
+    first_value,
+    dataset_window,
+    frame_value,
+    apply_window,
+    encode_jpeg,
+    render_dataset_jpeg,
+    convert_dicom_file,
+    find_dicom_files,
+    read_dataset,
+    read_frame_pixels,
+    scan_instance_uids,
+    file_digest,
+    DEFER_SIZE,
+    pyramid_filename,
+    render_pyramid,
+    write_file_atomic,
+)
 
 try:
-    import moviepy.editor as mpy
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
     MOVIEPY_AVAILABLE = True
 except ImportError:
     MOVIEPY_AVAILABLE = False
@@ -28,16 +62,110 @@ app = FastAPI()
 
 UPLOAD_ROOT = "./uploads"
 STATIC_JPEG_DIRNAME = "images_jpeg"
+MPR_DIRNAME = "mpr"
+CINE_DIRNAME = "cine"
+PACK_DIRNAME = "packs"
+# Originals of instances an appended upload replaces, until the merge commits
+MERGE_BACKUP_DIRNAME = ".merge_backup"
+INGEST_LOCK_FILENAME = ".ingest.lock"
 METADATA_FILENAME = "metadata.json"
+# Kept outside UPLOAD_ROOT so the /images static mount never exposes it
+CATALOG_PATH = os.environ.get("DICOM_CATALOG", "./catalog.sqlite3")
+CATALOG_SORT_COLUMNS = {
+    "patient": "patient_name",
+    "date": "study_date",
+    "description": "description",
+    "created": "id",
+}
+# Derived artifacts a maintenance pass may evict, cheapest to rebuild first;
+# all of them are regenerated on demand from the source DICOMs
+DERIVED_DIRNAMES = (CINE_DIRNAME, MPR_DIRNAME, PACK_DIRNAME, STATIC_JPEG_DIRNAME)
+DISK_BUDGET_BYTES = int(os.environ.get("DICOM_DISK_BUDGET_MB", 0)) * 1024 * 1024   # 0 = no cap on derived data
+DISK_MIN_FREE_BYTES = int(os.environ.get("DICOM_DISK_MIN_FREE_MB", 0)) * 1024 * 1024
+MAINTENANCE_INTERVAL = float(os.environ.get("DICOM_MAINTENANCE_SECONDS", 300))   # 0 = only on request
+EVICT_MIN_IDLE = float(os.environ.get("DICOM_EVICT_MIN_IDLE_SECONDS", 600))
+TEMP_MAX_AGE = float(os.environ.get("DICOM_TEMP_MAX_AGE_SECONDS", 3600))
+ACCESS_TOUCH_INTERVAL = 60
+MPR_ORIENTATIONS = ("axial", "coronal", "sagittal")
+# Volume axis each orientation slices along (volume is depth, rows, cols)
+MPR_AXES = {"axial": 0, "coronal": 1, "sagittal": 2}
+PROJECTION_MODES = {
+    "mip": sitk.MaximumProjection,
+    "minip": sitk.MinimumProjection,
+    "avg": sitk.MeanProjection,
+}
 
-DEFAULT_WINDOW = 2000
-DEFAULT_LEVEL = 1000
+# (window, level) in rescaled units (HU for CT)
+WINDOW_PRESETS = {
+    "soft_tissue": (400, 40),
+    "abdomen": (350, 50),
+    "lung": (1500, -600),
+    "mediastinum": (350, 50),
+    "bone": (2000, 300),
+    "brain": (80, 40),
+    "stroke": (40, 40),
+    "liver": (150, 30),
+}
 
-jpeg_cache = LRUCache(maxsize=2048)
-mpr_cache = LRUCache(maxsize=512)
+MB = 1024 * 1024
+# Adds a Server-Timing header with per-stage durations to every response
+TIMING_HEADER = os.environ.get("DICOM_TIMING_HEADER", "0") == "1"
+IMAGE_CACHE_CONTROL = f"public, max-age={int(os.environ.get('DICOM_IMAGE_MAX_AGE', 31536000))}"
+# For URLs whose content can change (appended uploads replace instances):
+# clients revalidate against the ETag every time
+MUTABLE_CACHE_CONTROL = "no-cache"
+
+# Rendered caches hold (jpeg_bytes, etag) and are bounded by total bytes
+jpeg_cache = LRUCache(maxsize=int(os.environ.get("DICOM_JPEG_CACHE_MB", 256)) * MB, getsizeof=lambda e: len(e[0]))
+mpr_cache = LRUCache(maxsize=int(os.environ.get("DICOM_MPR_CACHE_MB", 128)) * MB, getsizeof=lambda e: len(e[0]))
+pixel_cache = LRUCache(maxsize=int(os.environ.get("DICOM_PIXEL_CACHE_MB", 512)) * MB, getsizeof=lambda a: a.nbytes)
+cache_lock = threading.Lock()
+cache_stats = {name: {"hits": 0, "misses": 0} for name in ("jpeg", "mpr", "pixel", "shared")}
+# Rendered JPEGs shared by all worker processes behind the per-process caches
+# above; set DICOM_RENDER_SHM (e.g. /dev/shm/dicom-render) for a RAM tier in front
+shared_cache = make_render_cache(
+    os.environ.get("DICOM_RENDER_CACHE", "./render_cache"), int(os.environ.get("DICOM_RENDER_CACHE_MB", 1024)) * MB,
+    os.environ.get("DICOM_RENDER_SHM"), int(os.environ.get("DICOM_RENDER_SHM_MB", 128)) * MB,
+)
+
+# study_id -> parsed metadata.json plus UID lookup tables, keyed on file stat
+study_index = LRUCache(maxsize=int(os.environ.get("DICOM_INDEX_STUDIES", 64)))
+index_lock = threading.Lock()
+mpr_volumes = LRUCache(maxsize=int(os.environ.get("DICOM_MPR_VOLUMES", 4)))
+mpr_lock = threading.Lock()
+mpr_series_locks = {}
+# Optional per-series packs (see series_pack.py): rendered slices, and with
+# DICOM_PACK_PIXELS the rescaled pixels too, in one mmap-read file per series
+PACK_SERIES = os.environ.get("DICOM_PACK_SERIES", "0") == "1"
+PACK_PIXELS = os.environ.get("DICOM_PACK_PIXELS", "0") == "1"
+series_packs = LRUCache(maxsize=int(os.environ.get("DICOM_OPEN_PACKS", 64)))
+pack_lock = threading.Lock()
+cine_locks = {}
+cine_lock = threading.Lock()
 
 MAX_WORKERS = int(os.environ.get("DICOM_MAX_WORKERS", 2))
+PYRAMID_SIZES = tuple(sorted(int(x) for x in os.environ.get("DICOM_PYRAMID_SIZES", "128,256,512").split(",") if x.strip()))
+# 0 falls back to threads (MAX_WORKERS) for hosts where spawning is unwanted
+INGEST_PROCESSES = int(os.environ.get("DICOM_INGEST_PROCESSES", os.cpu_count() or 1))
+ingest_pool = None
+ingest_pool_lock = threading.Lock()
+logger = logging.getLogger("dicom_backend")
+INGEST_QUEUE_MAX = int(os.environ.get("DICOM_INGEST_QUEUE", 32))
+INGEST_PUBLISH_INTERVAL = float(os.environ.get("DICOM_INGEST_PUBLISH_SECONDS", 1.0))
+INGEST_JOBS = int(os.environ.get("DICOM_INGEST_JOBS", 1))
+ingest_executor = ThreadPoolExecutor(max_workers=INGEST_JOBS)
+ingest_jobs = {}
+# study_id -> open lock file, flocked from reservation until run_ingest ends
+ingest_locks = {}
+ingest_lock = threading.Lock()
+# Finished jobs are kept this long for /ingest; afterwards it answers from metadata.json
+INGEST_JOB_TTL = float(os.environ.get("DICOM_INGEST_JOB_TTL", 3600))
+INGEST_ACTIVE_STATES = ("queued", "extracting", "converting")
 mpr_semaphore = threading.Semaphore(int(os.environ.get("DICOM_MPR_MAX", 2)))
+# study_id -> when this process last recorded an access in the catalog
+study_access = {}
+maintenance_report = {}
+maintenance_lock = threading.Lock()
 
 def get_study_dir(study_id: str):
     return os.path.join(UPLOAD_ROOT, study_id)
@@ -45,143 +173,1009 @@ def get_study_dir(study_id: str):
 def get_jpeg_dir(study_id: str):
     return os.path.join(get_study_dir(study_id), STATIC_JPEG_DIRNAME)
 
+def get_mpr_dir(study_id: str):
+    return os.path.join(get_study_dir(study_id), MPR_DIRNAME)
+
+def get_pack_dir(study_id: str):
+    return os.path.join(get_study_dir(study_id), PACK_DIRNAME)
+
+def get_cine_dir(study_id: str):
+    return os.path.join(get_study_dir(study_id), CINE_DIRNAME)
+
 def get_metadata_path(study_id: str):
     return os.path.join(get_study_dir(study_id), METADATA_FILENAME)
 
 def get_all_dicoms(study_path):
-    dicoms = []
-    for root, _, files in os.walk(study_path):
-        for fname in files:
-            if fname.lower().endswith('.dcm'):
-                dicoms.append(os.path.join(root, fname))
-    return dicoms
-
-def dcm2jpeg(dcm_path, jpeg_path, window=DEFAULT_WINDOW, level=DEFAULT_LEVEL):
-    ds = pydicom.dcmread(dcm_path)
-    arr = ds.pixel_array.astype(np.float32)
-    w = float(window)
-    l = float(level)
-    arr = np.clip((arr - (l - 0.5)) / (w - 1) + 0.5, 0, 1) * 255
-    arr = arr.astype(np.uint8)
-    img = Image.fromarray(arr)
-    img.save(jpeg_path, format="JPEG")
-
-def jpeg_cache_key(study_id, series_id, image_id):
-    return f"{study_id}:{series_id}:{image_id}"
-
-def mpr_cache_key(study_id, orientation, slice_index):
-    return f"{study_id}:{orientation}:{slice_index}"
-
-def extract_and_convert(study_id: str, study_dir: str):
-    series_dict = {}
+    # Sniffed by content, so extensionless and DICOMDIR exports are picked up;
+    # our own derived outputs are never walked.
+    skip = {STATIC_JPEG_DIRNAME, MPR_DIRNAME, CINE_DIRNAME, PACK_DIRNAME, MERGE_BACKUP_DIRNAME, INGEST_LOCK_FILENAME, METADATA_FILENAME}
+    return list(find_dicom_files(study_path, skip=skip))
+
+def resolve_window(image, window=None, level=None, preset=None):
+    if preset:
+        if preset not in WINDOW_PRESETS:
+            raise HTTPException(400, f"Unknown window preset: {preset}")
+        return WINDOW_PRESETS[preset]
+    if window is None and level is None:
+        return None
+    if window is None:
+        window = image.get("WindowWidth", DEFAULT_WINDOW)
+    if level is None:
+        level = image.get("WindowCenter", DEFAULT_LEVEL)
+    return float(window), float(level)
+
+@timed("dcm2jpeg")
+def dcm2jpeg(dcm_path, jpeg_path, window=None, level=None, frame=None):
+    # Rendered before anything touches jpeg_path, so a failed render leaves
+    # no empty file behind and readers never see a partial one
+    ds = read_dataset(dcm_path, defer_size=DEFER_SIZE)
+    write_file_atomic(jpeg_path, render_dataset_jpeg(ds, window, level, frame))
+
+def image_revision(image):
+    # Bumped each time an appended upload replaces the instance
+    return image.get("revision", 0)
+
+def series_revision(series):
+    # Changes whenever the slices behind the series' volume do
+    return f"{len(series['images'])}.{series.get('revision', 0)}"
+
+def jpeg_cache_key(study_id, series_id, image, wl=None, size=None, quality=None):
+    key = f"{study_id}:{series_id}:{image['image_id']}"
+    if image_revision(image):
+        key += f"@{image_revision(image)}"
+    if wl is not None:
+        key += f":{wl[0]:g}/{wl[1]:g}"
+    if size:
+        key += f":s{size}"
+    if quality:
+        key += f":q{quality}"
+    return key
+
+def mpr_cache_key(study_id, series, orientation, slice_index, wl=None):
+    key = f"{study_id}:{series['series_id']}:v{series_revision(series)}:{orientation}:{slice_index}"
+    if wl is not None:
+        key += f":{wl[0]:g}/{wl[1]:g}"
+    return key
+
+def projection_cache_key(study_id, series, orientation, mode, slab, wl=None):
+    # Keyed by the slab's slice range, so thicknesses that round to the same
+    # slices share an entry
+    key = f"{study_id}:{series['series_id']}:v{series_revision(series)}:{orientation}:{mode}:{slab[0]}-{slab[1]}"
+    if wl is not None:
+        key += f":{wl[0]:g}/{wl[1]:g}"
+    return key
+
+def cache_lookup(name, cache, key):
+    with cache_lock:
+        value = cache.get(key)
+        cache_stats[name]["hits" if value is not None else "misses"] += 1
+    return value
+
+def cache_store(cache, key, value):
+    with cache_lock:
+        try:
+            cache[key] = value
+        except ValueError:
+            # Larger than the whole budget; serve it uncached
+            pass
+
+def jpeg_entry(jpeg_bytes):
+    return jpeg_bytes, f'"{hashlib.md5(jpeg_bytes).hexdigest()}"'
+
+def etag_matches(request: Request, etag: str):
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+def shared_lookup(name, key):
+    jpeg_bytes = shared_cache.get(name, key)
+    with cache_lock:
+        cache_stats["shared"]["hits" if jpeg_bytes is not None else "misses"] += 1
+    return jpeg_bytes
+
+def cached_jpeg_entry(name, cache, key, render, shared=True):
+    # Per-process LRU, then the cross-worker render cache, then render. Default
+    # renders are already JPEG files on disk and skip the shared tier.
+    entry = cache_lookup(name, cache, key)
+    if entry is None:
+        shared = shared and shared_cache is not None
+        jpeg_bytes = shared_lookup(name, key) if shared else None
+        if jpeg_bytes is None:
+            jpeg_bytes = render()
+            if shared:
+                shared_cache.set(name, key, jpeg_bytes)
+        entry = jpeg_entry(jpeg_bytes)
+        cache_store(cache, key, entry)
+    return entry
+
+def cached_jpeg_response(request: Request, name, cache, key, render, shared=True, cache_control=IMAGE_CACHE_CONTROL):
+    jpeg_bytes, etag = cached_jpeg_entry(name, cache, key, render, shared)
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=jpeg_bytes, media_type="image/jpeg", headers=headers)
+
+@timed("disk_read")
+def read_file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def series_pack_base(study_id: str, series_id: str):
+    return os.path.join(get_pack_dir(study_id), safe_name(series_id))
+
+def get_series_pack(study_id: str, series_id: str):
+    # Open packs are kept mapped and reopened when the index is rewritten
+    try:
+        stamp = os.stat(index_path(series_pack_base(study_id, series_id))).st_mtime_ns
+    except OSError:
+        return None
+    key = (study_id, series_id)
+    with pack_lock:
+        pack = series_packs.get(key)
+    if pack is not None and pack.stamp == stamp:
+        return pack
+    try:
+        pack = SeriesPack(series_pack_base(study_id, series_id))
+    except (OSError, ValueError):
+        return None
+    pack.stamp = stamp
+    with pack_lock:
+        series_packs[key] = pack
+    return pack
+
+def read_slice_jpeg(study_id: str, series_id: str, image, level=None):
+    # Zero-copy from the series pack when there is one, else the loose file
+    pack = get_series_pack(study_id, series_id)
+    if pack is not None:
+        name = image["jpeg_filename"] if level is None else pyramid_filename(image["jpeg_filename"], level)
+        data = pack.get(name)
+        if data is not None:
+            return data
+    if level is not None:
+        return read_file_bytes(ensure_pyramid_jpeg(study_id, image, level))
+    return read_file_bytes(ensure_slice_jpeg(study_id, image))
+
+def ensure_slice_jpeg(study_id: str, image):
     jpeg_dir = get_jpeg_dir(study_id)
-    if not os.path.exists(jpeg_dir):
+    jpeg_path = os.path.join(jpeg_dir, image["jpeg_filename"])
+    if not os.path.exists(jpeg_path):
+        dcm_path = os.path.join(get_study_dir(study_id), image["filename"])
+        if not os.path.exists(dcm_path):
+            raise HTTPException(404, "DICOM not found")
         os.makedirs(jpeg_dir, exist_ok=True)
-    dicom_paths = get_all_dicoms(study_dir)
+        dcm2jpeg(dcm_path, jpeg_path, frame=image.get("frame"))
+    return jpeg_path
+
+def pyramid_level(image, size=None):
+    # Smallest pyramid level that still covers the requested size; None = native
+    if not size:
+        return None
+    native = max(image.get("Columns", 0), image.get("Rows", 0))
+    return next((level for level in PYRAMID_SIZES if level >= size and level < native), None)
+
+def ensure_pyramid_jpeg(study_id: str, image, level):
+    path = os.path.join(get_jpeg_dir(study_id), pyramid_filename(image["jpeg_filename"], level))
+    if not os.path.exists(path):
+        # Backfill for studies ingested before the pyramid existed
+        with Image.open(ensure_slice_jpeg(study_id, image)) as img:
+            arr = np.asarray(img)
+        data = next((d for lvl, d in render_pyramid(arr, [level]) if lvl == level), None)
+        if data is None:
+            return ensure_slice_jpeg(study_id, image)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_file_atomic(path, data)
+    return path
 
-    def convert_one(fpath):
-        fname = os.path.relpath(fpath, study_dir)
+def render_slice_jpeg(study_id: str, series_id: str, image, wl=None, size=None, quality=None):
+    if wl is None and not quality:
+        return read_slice_jpeg(study_id, series_id, image, size)
+    if wl is not None:
+        pixels = get_slice_pixels(study_id, series_id, image)
+        with stage_timer("window"):
+            arr = apply_window(pixels, *wl)
+    else:
+        with Image.open(io.BytesIO(read_slice_jpeg(study_id, series_id, image))) as img:
+            arr = np.asarray(img)
+    if size and max(arr.shape[:2]) > size:
+        img = Image.fromarray(arr)
+        img.thumbnail((size, size), Image.BILINEAR)
+        arr = np.asarray(img)
+    with stage_timer("encode"):
+        return encode_jpeg(arr, quality)
+
+def get_slice_pixels(study_id: str, series_id: str, image):
+    pack = get_series_pack(study_id, series_id)
+    arr = pack.pixels(pixel_pack_name(image)) if pack is not None else None
+    if arr is not None:
+        # Already a read-only view of the page cache; nothing to decode or cache
+        return arr
+    cache_key = jpeg_cache_key(study_id, series_id, image)
+    arr = cache_lookup("pixel", pixel_cache, cache_key)
+    if arr is None:
+        dcm_path = os.path.join(get_study_dir(study_id), image["filename"])
+        if not os.path.exists(dcm_path):
+            raise HTTPException(404, "DICOM not found")
+        with stage_timer("decode"):
+            arr = read_frame_pixels(dcm_path, image.get("frame"))
+        arr.flags.writeable = False
+        cache_store(pixel_cache, cache_key, arr)
+    return arr
+
+def pixel_pack_name(image):
+    return f"px/{image['image_id']}"
+
+def series_jpeg_files(study_id: str, series, prefix=""):
+    # (arcname, path) for zip export; packed slices are (arcname, view, mtime)
+    # views into the open pack, which stays mapped until the stream ends even
+    # if the series is repacked meanwhile
+    pack = get_series_pack(study_id, series["series_id"])
+    files = []
+    for img in series["images"]:
+        data = pack.get(img["jpeg_filename"]) if pack is not None else None
+        if data is not None:
+            files.append((prefix + img["jpeg_filename"], data, pack.mtime))
+            continue
         try:
-            ds = pydicom.dcmread(fpath, stop_before_pixels=True, force=True)
-            series_uid = getattr(ds, "SeriesInstanceUID", None)
-            sop_uid = getattr(ds, "SOPInstanceUID", None)
-            if not series_uid:
-                series_uid = "SERIES_" + hashlib.md5(fname.encode()).hexdigest()
-            if not sop_uid:
-                sop_uid = "IMG_" + hashlib.md5(fname.encode()).hexdigest()
-            series_desc = getattr(ds, "SeriesDescription", "Series")
-            px_spacing = ds.get("PixelSpacing", [1.0, 1.0])
-            spacing_x = float(px_spacing[1]) if len(px_spacing) > 1 else float(px_spacing[0])
-            spacing_y = float(px_spacing[0])
-            cols = int(getattr(ds, "Columns", 512))
-            rows = int(getattr(ds, "Rows", 512))
-            instance_num = int(getattr(ds, "InstanceNumber", 0))
-            jpeg_filename = f"{series_uid}_{sop_uid}.jpg"
-            jpeg_path = os.path.join(jpeg_dir, jpeg_filename)
-            if not os.path.exists(jpeg_path):
+            # Rendered again if maintenance evicted it
+            files.append((prefix + img["jpeg_filename"], ensure_slice_jpeg(study_id, img)))
+        except HTTPException:
+            continue
+    return files
+
+def prefetch_map(executor, func, args_list, window):
+    # Futures of func(*args) in order, keeping up to window calls in flight
+    pending = deque()
+    try:
+        for args in args_list:
+            pending.append(submit_tracked("ingest_pool", executor, func, *args))
+            if len(pending) >= window:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+@timed("pack")
+def pack_series(study_id: str, series, refresh=()):
+    """
+    Compact a series' rendered slices and pyramid levels (plus pixels with
+    DICOM_PACK_PIXELS) into its pack, then drop the loose files. Entries
+    missing on disk are carried over from the previous pack, so packing is
+    repeatable; pixels of image_ids in refresh are decoded again.
+    """
+    jpeg_dir = get_jpeg_dir(study_id)
+    previous = get_series_pack(study_id, series["series_id"])
+    loose = []
+
+    def needs_decode(image):
+        return previous is None or image["image_id"] in refresh or pixel_pack_name(image) not in previous
+
+    # Pixels are decoded on the ingest pool a window ahead of the writer, in
+    # series order, rather than one by one on this thread
+    executor = get_ingest_pool() if PACK_PIXELS else None
+    decoded = prefetch_map(executor, read_frame_pixels, [
+        (os.path.join(get_study_dir(study_id), image["filename"]), image.get("frame"))
+        for image in series["images"] if PACK_PIXELS and needs_decode(image)
+    ], 2 * max(INGEST_PROCESSES, MAX_WORKERS))
+
+    def existing(name):
+        path = os.path.join(jpeg_dir, name)
+        if os.path.exists(path):
+            loose.append(path)
+            return read_file_bytes(path)
+        return previous.get(name) if previous is not None else None
+
+    def items():
+        for image in series["images"]:
+            pending = next(decoded) if PACK_PIXELS and needs_decode(image) else None
+            data = existing(image["jpeg_filename"])
+            if data is None:
                 try:
-                    dcm2jpeg(fpath, jpeg_path)
-                except Exception:
-                    return None
+                    data = read_file_bytes(ensure_slice_jpeg(study_id, image))
+                except HTTPException:
+                    continue
+                loose.append(os.path.join(jpeg_dir, image["jpeg_filename"]))
+            yield image["jpeg_filename"], data
+            for level in PYRAMID_SIZES:
+                name = pyramid_filename(image["jpeg_filename"], level)
+                data = existing(name)
+                if data is not None:
+                    yield name, data
+            if PACK_PIXELS:
+                if pending is None:
+                    yield pixel_pack_name(image), previous.pixels(pixel_pack_name(image))
+                    continue
+                try:
+                    arr = pending.result()
+                except BrokenProcessPool:
+                    reset_ingest_pool(executor)
+                    raise
+                yield pixel_pack_name(image), arr
+
+    os.makedirs(get_pack_dir(study_id), exist_ok=True)
+    try:
+        entries = write_pack(series_pack_base(study_id, series["series_id"]), items())
+    finally:
+        decoded.close()
+    for path in loose:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return len(entries)
+
+def pack_study(study_id: str, meta_json):
+    return {series["series_id"]: pack_series(study_id, series) for series in meta_json["series"]}
+
+def slice_position(ds, frame=None):
+    # Distance along the slice normal, so ordering follows patient geometry
+    # rather than whatever InstanceNumber the modality assigned.
+    iop = frame_value(ds, "ImageOrientationPatient", frame)
+    ipp = frame_value(ds, "ImagePositionPatient", frame)
+    if not iop or len(iop) != 6 or not ipp or len(ipp) != 3:
+        return None
+    normal = np.cross(np.array(iop[:3], dtype=float), np.array(iop[3:], dtype=float))
+    return float(np.dot(normal, np.array(ipp, dtype=float)))
+
+def mpr_volume_paths(study_id, series_id):
+    base = os.path.join(get_mpr_dir(study_id), safe_name(series_id))
+    return base + ".npy", base + ".json"
+
+@timed("mpr_build")
+def build_mpr_volume(study_id: str, series):
+    study_dir = get_study_dir(study_id)
+    volume_path, info_path = mpr_volume_paths(study_id, series["series_id"])
+    os.makedirs(os.path.dirname(volume_path), exist_ok=True)
+
+    slices = []
+    headers = {}
+    for img in series["images"]:
+        dcm_path = os.path.join(study_dir, img["filename"])
+        if dcm_path not in headers:
+            # Frames of a multi-frame object share one header read
             try:
-                with open(jpeg_path, "rb") as jf:
-                    jpeg_bytes = jf.read()
-                    cache_key = jpeg_cache_key(study_id, series_uid, sop_uid)
-                    jpeg_cache[cache_key] = jpeg_bytes
+                headers[dcm_path] = pydicom.dcmread(dcm_path, stop_before_pixels=True, force=True)
             except Exception:
-                pass
-            window_center = DEFAULT_LEVEL
-            window_width = DEFAULT_WINDOW
-            return (
-                series_uid, {
-                    "image_id": sop_uid,
-                    "filename": fname,
-                    "jpeg_filename": jpeg_filename,
-                    "instanceNumber": instance_num,
-                    "pixelSpacingX": spacing_x,
-                    "pixelSpacingY": spacing_y,
-                    "Columns": cols,
-                    "Rows": rows,
-                    "WindowCenter": window_center,
-                    "WindowWidth": window_width,
-                },
-                series_desc
-            )
-        except Exception:
-            return None
+                headers[dcm_path] = None
+        ds = headers[dcm_path]
+        if ds is None:
+            continue
+        frame = img.get("frame")
+        slices.append({
+            "path": dcm_path,
+            "frame": frame,
+            "position": slice_position(ds, frame),
+            "instanceNumber": img["instanceNumber"],
+            "shape": (int(ds.get("Rows", 0)), int(ds.get("Columns", 0))),
+            "header": ds,
+        })
+    if not slices:
+        raise HTTPException(404, "No readable DICOMs in series")
+
+    # Keep only slices matching the dominant matrix size (drops scouts/localizers)
+    shapes = [s["shape"] for s in slices]
+    shape = max(set(shapes), key=shapes.count)
+    slices = [s for s in slices if s["shape"] == shape]
+    if all(s["position"] is not None for s in slices):
+        slices.sort(key=lambda s: s["position"])
+        gaps = np.diff([s["position"] for s in slices])
+        gaps = gaps[gaps > 1e-4]
+        slice_spacing = round(float(np.median(gaps)), 6) if len(gaps) else 0.0
+    else:
+        slices.sort(key=lambda s: (s["instanceNumber"], s["frame"] or 0))
+        slice_spacing = 0.0
+
+    first, first_frame = slices[0]["header"], slices[0]["frame"]
+    if slice_spacing <= 0:
+        slice_spacing = (
+            first_value(first.get("SpacingBetweenSlices"), None)
+            or first_value(frame_value(first, "SliceThickness", first_frame), 1.0)
+        )
+    px_spacing = frame_value(first, "PixelSpacing", first_frame) or [1.0, 1.0]
+    spacing_y = float(px_spacing[0])
+    spacing_x = float(px_spacing[1]) if len(px_spacing) > 1 else spacing_y
+
+    rows, cols = shape
+    tmp_path = volume_path + ".tmp"
+    volume = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.int16, shape=(len(slices), rows, cols))
+
+    def load_one(idx):
+        volume[idx] = read_frame_pixels(slices[idx]["path"], slices[idx]["frame"])
 
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        for r in executor.map(convert_one, dicom_paths):
-            if r is not None:
-                series_uid, imgdict, sdesc = r
-                if series_uid not in series_dict:
-                    series_dict[series_uid] = {
-                        "series_id": series_uid,
-                        "seriesDescription": str(sdesc),
-                        "images": []
-                    }
-                series_dict[series_uid]["images"].append(imgdict)
-    for s in series_dict.values():
-        s["images"].sort(key=lambda img: img["instanceNumber"])
-    return list(series_dict.values())
-
-def extract_study_metadata(study_dir: str):
-    dicoms = get_all_dicoms(study_dir)
-    if not dicoms:
-        return {
-            "patientName": "Unknown",
-            "studyDate": "Unknown",
-            "description": "No Description"
-        }
-    try:
-        ds = pydicom.dcmread(dicoms[0], stop_before_pixels=True, force=True)
-        return {
-            "patientName": str(ds.get("PatientName", "Unknown")),
-            "studyDate": str(ds.get("StudyDate", "Unknown")),
-            "description": str(ds.get("StudyDescription", "No Description"))
-        }
-    except Exception:
-        return {
-            "patientName": "Unknown",
-            "studyDate": "Unknown",
-            "description": "No Description"
-        }
-
-def build_metadata_json(study_id: str, study_dir: str):
-    meta = extract_study_metadata(study_dir)
-    structure = extract_and_convert(study_id, study_dir)
+        list(executor.map(load_one, range(len(slices))))
+    volume.flush()
+    del volume
+    os.replace(tmp_path, volume_path)
+
+    info = {
+        "series_id": series["series_id"],
+        "num_images": len(series["images"]),
+        "revision": series.get("revision", 0),
+        "shape": [len(slices), rows, cols],
+        "spacing": [slice_spacing, spacing_y, spacing_x],
+        "window": dataset_window(first, first_frame)[0],
+        "level": dataset_window(first, first_frame)[1],
+    }
+    with open(info_path + ".tmp", "w") as f:
+        json.dump(info, f)
+    os.replace(info_path + ".tmp", info_path)
+    return info
+
+def mpr_volume_current(volume, series):
+    return (
+        volume is not None
+        and volume.get("num_images") == len(series["images"])
+        and volume.get("revision", 0) == series.get("revision", 0)
+    )
+
+def get_mpr_volume(study_id: str, series):
+    # A volume built from a partial publish is stale once more slices land
+    key = (study_id, series["series_id"])
+    with mpr_lock:
+        volume = mpr_volumes.get(key)
+        if mpr_volume_current(volume, series):
+            return volume
+        series_lock = mpr_series_locks.setdefault(key, threading.Lock())
+    with series_lock:
+        with mpr_lock:
+            volume = mpr_volumes.get(key)
+        if mpr_volume_current(volume, series):
+            return volume
+        volume_path, info_path = mpr_volume_paths(study_id, series["series_id"])
+        info = None
+        if os.path.exists(volume_path) and os.path.exists(info_path):
+            try:
+                with open(info_path, "r") as f:
+                    info = json.load(f)
+            except Exception:
+                info = None
+        if not mpr_volume_current(info, series):
+            with mpr_semaphore:
+                info = build_mpr_volume(study_id, series)
+        volume = dict(info, data=np.load(volume_path, mmap_mode="r"))
+        with mpr_lock:
+            mpr_volumes[key] = volume
+        return volume
+
+def mpr_num_slices(volume, orientation):
+    depth, rows, cols = volume["shape"]
+    return {"axial": depth, "coronal": rows, "sagittal": cols}[orientation]
+
+def render_mpr_slice(volume, orientation, slice_index, wl=None):
+    plane = np.take(volume["data"], slice_index, axis=MPR_AXES[orientation])
+    return render_mpr_plane(volume, orientation, plane, wl)
+
+def render_mpr_plane(volume, orientation, plane, wl=None):
+    slice_spacing, spacing_y, spacing_x = volume["spacing"]
+    if orientation == "axial":
+        aspect = 1.0
+    elif orientation == "coronal":
+        # Volume is stored inferior -> superior; flip so the head is up
+        plane = plane[::-1]
+        aspect = slice_spacing / spacing_x
+    else:
+        plane = plane[::-1]
+        aspect = slice_spacing / spacing_y
+    window, level = wl if wl is not None else (volume["window"], volume["level"])
+    with stage_timer("window"):
+        img = Image.fromarray(apply_window(plane, window, level))
+    if abs(aspect - 1.0) > 1e-3:
+        img = img.resize((img.width, max(1, int(round(img.height * aspect)))), Image.BILINEAR)
+    buf = io.BytesIO()
+    with stage_timer("encode"):
+        img.save(buf, format="JPEG")
+    return buf.getvalue()
+
+def projection_slab(volume, orientation, slice_index, thickness):
+    # [start, end) slices covering thickness mm around slice_index
+    axis = MPR_AXES[orientation]
+    spacing = volume["spacing"][axis]
+    count = max(1, int(round(thickness / spacing))) if spacing > 0 else 1
+    depth = volume["shape"][axis]
+    start = min(max(0, slice_index - count // 2), max(0, depth - count))
+    return start, min(depth, start + count)
+
+def project_slab(volume, orientation, slab, mode):
+    axis = MPR_AXES[orientation]
+    index = [slice(None)] * 3
+    index[axis] = slice(*slab)
+    image = sitk.GetImageFromArray(np.ascontiguousarray(volume["data"][tuple(index)]))
+    # SimpleITK orders dimensions x, y, z; numpy axis 0 is z
+    projected = sitk.GetArrayFromImage(PROJECTION_MODES[mode](image, projectionDimension=2 - axis))
+    plane = np.take(projected, 0, axis=axis)
+    if mode == "avg":
+        plane = np.rint(plane)
+    return plane.astype(np.int16)
+
+def render_projection(volume, orientation, slab, mode, wl=None):
+    with stage_timer("project"):
+        plane = project_slab(volume, orientation, slab, mode)
+    return render_mpr_plane(volume, orientation, plane, wl)
+
+def select_mpr_series(study_id: str, series_id=None):
+    # Volumes need every slice; while ingest is still publishing partial
+    # series the client should retry rather than cache a truncated render
+    entry = require_study(study_id)
+    if entry["meta"].get("status") in INGEST_ACTIVE_STATES or ingest_active(study_id):
+        raise HTTPException(409, "Study is still being ingested")
+    if series_id:
+        series = find_series(entry, series_id)
+    else:
+        series = max(entry["meta"]["series"], key=lambda s: len(s["images"]), default=None)
+    if not series or not series["images"]:
+        raise HTTPException(404, "Series not found")
+    return series
+
+def evict_study_caches(study_id: str):
+    with mpr_lock:
+        for key in [k for k in mpr_volumes.keys() if k[0] == study_id]:
+            del mpr_volumes[key]
+    with pack_lock:
+        for key in [k for k in series_packs.keys() if k[0] == study_id]:
+            del series_packs[key]
+    with cache_lock:
+        for cache in (mpr_cache, jpeg_cache, pixel_cache):
+            for key in [k for k in cache.keys() if k.startswith(f"{study_id}:")]:
+                del cache[key]
+    if shared_cache is not None:
+        shared_cache.evict_study(study_id)
+
+def get_ingest_pool():
+    global ingest_pool
+    with ingest_pool_lock:
+        if ingest_pool is None:
+            if INGEST_PROCESSES > 0:
+                # spawn: forking a threaded server process can deadlock in the child
+                ingest_pool = ProcessPoolExecutor(
+                    max_workers=INGEST_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                ingest_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        return ingest_pool
+
+def reset_ingest_pool(broken):
+    global ingest_pool
+    with ingest_pool_lock:
+        if ingest_pool is broken:
+            ingest_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def image_sort_key(img):
+    return img["instanceNumber"], img.get("frame", 0)
+
+@timed("ingest")
+def extract_and_convert(study_id: str, study_dir: str, on_progress=None, study_meta=None, dicom_paths=None):
+    # dicom_paths limits conversion to those files (incremental append);
+    # by default the whole study directory is scanned
+    series_dict = {}
+    jpeg_dir = get_jpeg_dir(study_id)
+    if not os.path.exists(jpeg_dir):
+        os.makedirs(jpeg_dir, exist_ok=True)
+    dicom_paths = sorted(get_all_dicoms(study_dir) if dicom_paths is None else dicom_paths)
+
+    def snapshot():
+        return [dict(s, images=sorted(s["images"], key=image_sort_key)) for s in series_dict.values()]
+
+    total = len(dicom_paths)
+    started = last_publish = time.monotonic()
+    first_path = None
+    executor = get_ingest_pool()
+    futures = {
+        submit_tracked("ingest_pool", executor, convert_dicom_file, p, study_dir, jpeg_dir, PYRAMID_SIZES): p
+        for p in dicom_paths
+    }
+    for done, future in enumerate(as_completed(futures), 1):
+        try:
+            r = future.result()
+        except BrokenProcessPool:
+            reset_ingest_pool(executor)
+            raise
+        if r is not None:
+            series_uid = r["series_uid"]
+            if series_uid not in series_dict:
+                series_dict[series_uid] = {
+                    "series_id": series_uid,
+                    "seriesDescription": r["series_description"],
+                    "images": []
+                }
+            series_dict[series_uid]["images"].extend(r["images"])
+            if study_meta is not None and (first_path is None or futures[future] < first_path):
+                first_path = futures[future]
+                study_meta.update(r["study"])
+            if r["jpeg_bytes"] is not None:
+                cache_store(jpeg_cache, jpeg_cache_key(study_id, series_uid, r["images"][0]), jpeg_entry(r["jpeg_bytes"]))
+        if on_progress and (done == total or time.monotonic() - last_publish >= INGEST_PUBLISH_INTERVAL):
+            on_progress(snapshot, done, total)
+            last_publish = time.monotonic()
+    elapsed = time.monotonic() - started
+    if total:
+        logger.info("ingest %s: %d files in %.2fs (%.1f files/s)", study_id, total, elapsed, total / max(elapsed, 1e-6))
+    return snapshot()
+
+def write_metadata_json(study_id: str, meta_json):
+    # Written via rename so readers never see a half-written document
+    path = get_metadata_path(study_id)
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta_json, f)
+    os.replace(path + ".tmp", path)
+    invalidate_study_index(study_id)
+    catalog_upsert(meta_json)
+
+def build_metadata_json(study_id: str, study_dir: str, progress=None):
     meta_json = {
         "study_id": study_id,
-        "patientName": meta["patientName"],
-        "studyDate": meta["studyDate"],
-        "description": meta["description"],
-        "series": structure,
-        "ai_analysis": None
+        "patientName": "Unknown",
+        "studyDate": "Unknown",
+        "description": "No Description",
+        "series": [],
+        "ai_analysis": None,
+        "status": "converting",
     }
-    with open(get_metadata_path(study_id), "w") as f:
-        json.dump(meta_json, f)
+
+    def publish(snapshot, done, total):
+        # Completed slices become viewable while the rest of the study converts
+        meta_json["series"] = snapshot()
+        write_metadata_json(study_id, meta_json)
+        if progress:
+            progress(done, total)
+
+    meta_json["series"] = extract_and_convert(
+        study_id, study_dir,
+        on_progress=publish if progress else None,
+        study_meta=meta_json,
+    )
+    meta_json["status"] = "ready"
+    write_metadata_json(study_id, meta_json)
     return meta_json
 
+def set_ingest_state(study_id: str, state: str, **fields):
+    with ingest_lock:
+        job = ingest_jobs.setdefault(study_id, {"state": state, "done": 0, "total": 0, "error": None})
+        job["state"] = state
+        job["updated"] = time.time()
+        job.update(fields)
+
+def append_target(study_id: str, study_dir: str):
+    """
+    Existing study an upload belongs to: every readable file carries the same
+    StudyInstanceUID and a ready study with that UID is already in the
+    catalog. Returns (target_id, [(path, sop_uid)]) or None.
+    """
+    instances = []
+    study_uids = set()
+    for path, study_uid, sop_uid in scan_instance_uids(get_all_dicoms(study_dir)):
+        study_uids.add(study_uid)
+        instances.append((path, sop_uid))
+    if len(study_uids) != 1 or "" in study_uids:
+        return None
+    target_id = catalog_find_study_uid(study_uids.pop(), study_id)
+    if target_id is None or ingest_active(target_id) or not load_metadata_json(target_id):
+        return None
+    return target_id, instances
+
+def remove_slice_outputs(study_id: str, image):
+    jpeg_dir = get_jpeg_dir(study_id)
+    for name in [image["jpeg_filename"]] + [pyramid_filename(image["jpeg_filename"], level) for level in PYRAMID_SIZES]:
+        try:
+            os.remove(os.path.join(jpeg_dir, name))
+        except OSError:
+            pass
+
+def undo_renames(journal):
+    # Reverse every os.replace a failed merge made, newest first
+    for src, dst in reversed(journal):
+        os.makedirs(os.path.dirname(src), exist_ok=True)
+        os.replace(dst, src)
+
+def merge_files(upload_id: str, target_id: str, meta_json, instances, journal):
+    """
+    Sort an upload's instances against the target study: identical ones are
+    dropped, changed ones replace the stored file (the original is parked in
+    the upload directory until the merge commits) and new ones move under
+    upload_<id>/. Every rename is recorded in journal. Returns (to_convert,
+    replaced filenames, duplicate count).
+    """
+    upload_dir = get_study_dir(upload_id)
+    target_dir = get_study_dir(target_id)
+    known = {}
+    for series in meta_json["series"]:
+        for image in series["images"]:
+            known.setdefault(image.get("sopInstanceUID", image["image_id"]), image["filename"])
+    digests = {}
+
+    def digest_of(path):
+        if path not in digests:
+            digests[path] = file_digest(path)
+        return digests[path]
+
+    def move(src, dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+        journal.append((src, dst))
+
+    # Files without a SOPInstanceUID can only be matched by content
+    anonymous = None
+    to_convert, replaced, duplicates = [], set(), 0
+    seen = set()
+    for path, sop_uid in sorted(instances):
+        if sop_uid and sop_uid in seen:
+            duplicates += 1
+            continue
+        seen.add(sop_uid)
+        if not sop_uid:
+            if anonymous is None:
+                anonymous = {
+                    digest_of(os.path.join(target_dir, fname))
+                    for key, fname in known.items()
+                    if key.startswith("IMG_") and os.path.exists(os.path.join(target_dir, fname))
+                }
+            if digest_of(path) in anonymous:
+                duplicates += 1
+                continue
+            anonymous.add(digest_of(path))
+        elif sop_uid in known:
+            existing = os.path.join(target_dir, known[sop_uid])
+            if os.path.exists(existing):
+                if digest_of(existing) == digest_of(path):
+                    duplicates += 1
+                    continue
+                move(existing, os.path.join(upload_dir, MERGE_BACKUP_DIRNAME, known[sop_uid]))
+            move(path, existing)
+            replaced.add(known[sop_uid])
+            to_convert.append(existing)
+            continue
+        dest = os.path.join(target_dir, f"upload_{upload_id}", os.path.relpath(path, upload_dir))
+        move(path, dest)
+        to_convert.append(dest)
+    return to_convert, replaced, duplicates
+
+def merge_series(meta_json, converted, replaced):
+    """
+    Fold converted series into the study metadata. Records of replaced files
+    give way to the new ones with their revision bumped, and every touched
+    series gets a new revision. Returns (touched series_ids, replaced image_ids).
+    """
+    revisions = {}
+    for series in meta_json["series"]:
+        for image in series["images"]:
+            if image["filename"] in replaced:
+                revisions[image["image_id"]] = image_revision(image)
+        series["images"] = [img for img in series["images"] if img["filename"] not in replaced]
+    by_id = {series["series_id"]: series for series in meta_json["series"]}
+    for series in converted:
+        for image in series["images"]:
+            if image["filename"] in replaced:
+                image["revision"] = revisions.get(image["image_id"], 0) + 1
+        current = by_id.get(series["series_id"])
+        if current is None:
+            meta_json["series"].append(series)
+            continue
+        images = {img["image_id"]: img for img in current["images"]}
+        images.update((img["image_id"], img) for img in series["images"])
+        current["images"] = sorted(images.values(), key=image_sort_key)
+        current["revision"] = current.get("revision", 0) + 1
+    meta_json["series"] = [series for series in meta_json["series"] if series["images"]]
+    return {series["series_id"] for series in converted}, set(revisions)
+
+def merge_locked(upload_id: str, target_id: str, instances):
+    target_dir = get_study_dir(target_id)
+    meta_json = load_metadata_json(target_id)
+    original = copy.deepcopy(meta_json)
+    journal, stale, converted = [], [], []
+    try:
+        to_convert, replaced, duplicates = merge_files(upload_id, target_id, meta_json, instances, journal)
+        if to_convert:
+            # Outputs of replaced instances go first, or conversion would
+            # find them on disk and keep the old render
+            stale = [img for series in meta_json["series"] for img in series["images"] if img["filename"] in replaced]
+            for image in stale:
+                remove_slice_outputs(target_id, image)
+            converted = extract_and_convert(target_id, target_dir, dicom_paths=to_convert)
+            affected, refresh = merge_series(meta_json, converted, replaced)
+            write_metadata_json(target_id, meta_json)
+    except Exception:
+        logger.exception("merging upload %s into %s failed, rolling back", upload_id, target_id)
+        try:
+            undo_renames(journal)
+            # Only emptied directories are left behind by the renames
+            shutil.rmtree(os.path.join(target_dir, f"upload_{upload_id}"), ignore_errors=True)
+            shutil.rmtree(os.path.join(get_study_dir(upload_id), MERGE_BACKUP_DIRNAME), ignore_errors=True)
+            for image in stale + [img for series in converted for img in series["images"]]:
+                remove_slice_outputs(target_id, image)
+            write_metadata_json(target_id, original)
+            evict_study_caches(target_id)
+        except Exception as e:
+            set_ingest_state(target_id, "failed", error=f"rolling back upload {upload_id} failed: {e}")
+            raise
+        set_ingest_state(target_id, "ready")
+        raise
+
+    if to_convert:
+        # Committed; derived outputs of the touched series are rebuilt on demand
+        evict_study_caches(target_id)
+        for series_id in affected:
+            for path in mpr_volume_paths(target_id, series_id):
+                remove_file(path)
+        shutil.rmtree(get_cine_dir(target_id), ignore_errors=True)
+        for series in meta_json["series"]:
+            if series["series_id"] not in affected:
+                continue
+            if PACK_SERIES or os.path.exists(index_path(series_pack_base(target_id, series["series_id"]))):
+                try:
+                    pack_series(target_id, series, refresh=refresh)
+                except Exception:
+                    # Without the stale pack, reads fall back to loose files
+                    logger.exception("repacking %s/%s after merge failed", target_id, series["series_id"])
+                    remove_file(index_path(series_pack_base(target_id, series["series_id"])))
+    set_ingest_state(target_id, "ready")
+    added = len(to_convert) - len(replaced)
+    return {"added": added, "replaced": len(replaced), "duplicates": duplicates}
+
+@timed("merge")
+def merge_upload(upload_id: str, target_id: str, instances):
+    """
+    Append an upload to an existing study. Instances already present with
+    identical content are dropped, ones whose SOPInstanceUID is known but
+    whose bytes changed replace the stored file, and the rest are moved in;
+    only the replaced and new files are converted. If anything fails before
+    the metadata is committed, every file is moved back and the upload is
+    left as a failed study. Returns counts of added/replaced/duplicate files.
+    """
+    # Serialised across workers: two uploads of the same study must not
+    # interleave their metadata read-modify-write
+    with open(CATALOG_PATH + ".merge.lock", "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            set_ingest_state(target_id, "converting", done=0, total=0)
+            counts = merge_locked(upload_id, target_id, instances)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    shutil.rmtree(get_study_dir(upload_id), ignore_errors=True)
+    invalidate_study_index(upload_id)
+    catalog_delete(upload_id)
+    logger.info(
+        "merged upload %s into %s: %d added, %d replaced, %d duplicate",
+        upload_id, target_id, counts["added"], counts["replaced"], counts["duplicates"],
+    )
+    return counts
+
+def run_ingest(study_id: str, zip_path=None):
+    study_dir = get_study_dir(study_id)
+    try:
+        if zip_path:
+            set_ingest_state(study_id, "extracting")
+            with zipfile.ZipFile(zip_path, "r") as zip_ref:
+                zip_ref.extractall(study_dir)
+            os.remove(zip_path)
+        set_ingest_state(study_id, "converting")
+        started = time.monotonic()
+
+        def progress(done, total):
+            rate = done / max(time.monotonic() - started, 1e-6)
+            set_ingest_state(study_id, "converting", done=done, total=total, files_per_second=round(rate, 1))
+
+        target = append_target(study_id, study_dir)
+        if target is not None:
+            target_id, instances = target
+            counts = merge_upload(study_id, target_id, instances)
+            set_ingest_state(study_id, "merged", merged_into=target_id, **counts)
+            return
+        meta_json = build_metadata_json(study_id, study_dir, progress=progress)
+        if PACK_SERIES:
+            pack_study(study_id, meta_json)
+        set_ingest_state(study_id, "ready")
+    except Exception as e:
+        set_ingest_state(study_id, "failed", error=str(e))
+        meta_json = load_metadata_json(study_id) or {"study_id": study_id, "series": []}
+        meta_json["status"] = "failed"
+        try:
+            write_metadata_json(study_id, meta_json)
+        except Exception:
+            pass
+        if zip_path and os.path.exists(zip_path):
+            os.remove(zip_path)
+    finally:
+        release_ingest_lock(study_id)
+
+def acquire_ingest_lock(study_id: str) -> bool:
+    """
+    Hold the study's ingest flock until release_ingest_lock. The kernel drops
+    it if the process dies, so a study whose metadata still says "queued" but
+    whose lock is free was orphaned by a restart.
+    """
+    lock_file = open(os.path.join(get_study_dir(study_id), INGEST_LOCK_FILENAME), "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    with ingest_lock:
+        ingest_locks[study_id] = lock_file
+    return True
+
+def release_ingest_lock(study_id: str):
+    with ingest_lock:
+        lock_file = ingest_locks.pop(study_id, None)
+    if lock_file is not None:
+        lock_file.close()
+
+def prune_ingest_jobs(now: float):
+    # Caller holds ingest_lock
+    expired = [sid for sid, job in ingest_jobs.items()
+               if job["state"] not in INGEST_ACTIVE_STATES and now - job.get("updated", now) > INGEST_JOB_TTL]
+    for sid in expired:
+        del ingest_jobs[sid]
+
+def reserve_ingest(study_id: str):
+    with ingest_lock:
+        now = time.time()
+        prune_ingest_jobs(now)
+        pending = sum(1 for job in ingest_jobs.values() if job["state"] in INGEST_ACTIVE_STATES)
+        if pending >= INGEST_QUEUE_MAX:
+            raise HTTPException(503, "Ingest queue is full, retry later")
+        ingest_jobs[study_id] = {"state": "queued", "done": 0, "total": 0, "error": None, "updated": now}
+    if not acquire_ingest_lock(study_id):
+        with ingest_lock:
+            del ingest_jobs[study_id]
+        raise HTTPException(409, "Study is already being ingested")
+
+def submit_ingest(study_id: str, zip_path=None):
+    write_metadata_json(study_id, {
+        "study_id": study_id,
+        "patientName": "Unknown",
+        "studyDate": "Unknown",
+        "description": "No Description",
+        "series": [],
+        "ai_analysis": None,
+        "status": "queued",
+    })
+    submit_tracked("ingest_jobs", ingest_executor, run_ingest, study_id, zip_path)
+
+def recover_interrupted_ingests():
+    """
+    Requeue studies whose metadata.json still says an ingest is under way but
+    which no live worker holds the ingest lock for. A ZIP upload that was
+    never extracted is still in the study directory and is extracted again.
+    """
+    requeued = []
+    for study_id in sorted(os.listdir(UPLOAD_ROOT)):
+        meta_json = load_metadata_json(study_id)
+        if not meta_json or meta_json.get("status") not in INGEST_ACTIVE_STATES:
+            continue
+        if ingest_active(study_id) or not acquire_ingest_lock(study_id):
+            continue
+        study_dir = get_study_dir(study_id)
+        zips = [entry.path for entry in os.scandir(study_dir) if entry.is_file() and zipfile.is_zipfile(entry.path)]
+        with ingest_lock:
+            ingest_jobs[study_id] = {"state": "queued", "done": 0, "total": 0, "error": None, "updated": time.time()}
+        submit_tracked("ingest_jobs", ingest_executor, run_ingest, study_id, zips[0] if zips else None)
+        requeued.append(study_id)
+    if requeued:
+        logger.warning("Requeued %d interrupted ingest(s): %s", len(requeued), ", ".join(requeued))
+    return requeued
+
+def ingest_active(study_id: str):
+    with ingest_lock:
+        job = ingest_jobs.get(study_id)
+        return job is not None and job["state"] in INGEST_ACTIVE_STATES
+
+def discard_upload(study_id: str):
+    release_ingest_lock(study_id)
+    shutil.rmtree(get_study_dir(study_id), ignore_errors=True)
+    catalog_delete(study_id)
+
+def save_upload(file: UploadFile, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+@timed("metadata_load")
 def load_metadata_json(study_id: str):
     try:
         with open(get_metadata_path(study_id), "r") as f:
@@ -189,6 +1183,222 @@ def load_metadata_json(study_id: str):
     except Exception:
         return None
 
+def load_study_index(study_id: str):
+    try:
+        st = os.stat(get_metadata_path(study_id))
+    except OSError:
+        invalidate_study_index(study_id)
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    with index_lock:
+        entry = study_index.get(study_id)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry
+    meta_json = load_metadata_json(study_id)
+    if not meta_json:
+        return None
+    entry = {
+        "stamp": stamp,
+        "meta": meta_json,
+        "series": {
+            s["series_id"]: {"series": s, "images": {img["image_id"]: img for img in s["images"]}}
+            for s in meta_json["series"]
+        },
+        "json": None,
+    }
+    with index_lock:
+        study_index[study_id] = entry
+    return entry
+
+def invalidate_study_index(study_id: str):
+    with index_lock:
+        study_index.pop(study_id, None)
+
+def require_study(study_id: str):
+    entry = load_study_index(study_id)
+    if not entry:
+        raise HTTPException(404, "Study not found")
+    touch_study(study_id)
+    return entry
+
+def find_series(entry, series_id: str):
+    found = entry["series"].get(series_id)
+    if not found:
+        raise HTTPException(404, "Series not found")
+    return found["series"]
+
+def find_image(entry, series_id: str, image_id: str):
+    found = entry["series"].get(series_id)
+    if not found:
+        raise HTTPException(404, "Series not found")
+    image = found["images"].get(image_id)
+    if not image:
+        raise HTTPException(404, "Image not found")
+    return image
+
+def find_frame(entry, series_id: str, image_id: str, frame: int):
+    # Frames of a multi-frame instance are indexed as "<SOPInstanceUID>_f<n>";
+    # frame 0 of a single-frame instance is the instance itself.
+    found = entry["series"].get(series_id)
+    if found and frame == 0 and f"{image_id}_f0" not in found["images"]:
+        return find_image(entry, series_id, image_id)
+    return find_image(entry, series_id, f"{image_id}_f{frame}")
+
+def source_images(images):
+    # One entry per file; all frames of a multi-frame object share it
+    return list({img["filename"]: img for img in images}.values())
+
+def study_json_bytes(entry):
+    # Serialised once per metadata.json revision
+    if entry["json"] is None:
+        entry["json"] = json.dumps(make_json_serializable(entry["meta"])).encode()
+    return entry["json"]
+
+@contextmanager
+def catalog_db():
+    conn = sqlite3.connect(CATALOG_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def init_catalog():
+    seed = not os.path.exists(CATALOG_PATH)
+    with catalog_db() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS studies ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " study_id TEXT UNIQUE NOT NULL,"
+            " patient_name TEXT NOT NULL DEFAULT '',"
+            " study_date TEXT NOT NULL DEFAULT '',"
+            " description TEXT NOT NULL DEFAULT '',"
+            " status TEXT NOT NULL DEFAULT 'ready',"
+            " num_series INTEGER NOT NULL DEFAULT 0,"
+            " num_images INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL DEFAULT 0,"
+            " study_uid TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(studies)")}
+        if "accessed_at" not in columns:
+            conn.execute("ALTER TABLE studies ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+        if "study_uid" not in columns:
+            conn.execute("ALTER TABLE studies ADD COLUMN study_uid TEXT NOT NULL DEFAULT ''")
+        for column in ("patient_name", "study_date", "description", "study_uid"):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS studies_{column} ON studies ({column})")
+    if seed:
+        sync_catalog()
+
+def sync_catalog():
+    # One-off import of studies that predate the catalog
+    if not os.path.exists(UPLOAD_ROOT):
+        return
+    for study_folder in sorted(os.listdir(UPLOAD_ROOT)):
+        if not os.path.isdir(get_study_dir(study_folder)):
+            continue
+        meta_json = load_metadata_json(study_folder) or {"study_id": study_folder, "series": [], "status": "pending"}
+        meta_json["study_id"] = study_folder
+        catalog_upsert(meta_json)
+
+def catalog_upsert(meta_json):
+    study_id = str(meta_json["study_id"])
+    series = meta_json.get("series") or []
+    now = time.time()
+    row = (
+        study_id,
+        str(meta_json.get("patientName", "Unknown")),
+        str(meta_json.get("studyDate", "Unknown")),
+        str(meta_json.get("description", "No Description")),
+        meta_json.get("status", "ready"),
+        len(series),
+        sum(len(s["images"]) for s in series),
+        now,
+        now,
+        str(meta_json.get("studyInstanceUID", "")),
+    )
+    sql = (
+        "INSERT INTO studies (id, study_id, patient_name, study_date, description, status,"
+        " num_series, num_images, created_at, updated_at, study_uid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+        " ON CONFLICT(study_id) DO UPDATE SET patient_name = excluded.patient_name,"
+        " study_date = excluded.study_date, description = excluded.description,"
+        " status = excluded.status, num_series = excluded.num_series,"
+        " num_images = excluded.num_images, updated_at = excluded.updated_at,"
+        " study_uid = excluded.study_uid"
+    )
+    with catalog_db() as conn:
+        try:
+            conn.execute(sql, (int(study_id) if study_id.isdigit() else None,) + row)
+        except sqlite3.IntegrityError:
+            conn.execute(sql, (None,) + row)
+
+def touch_study(study_id: str):
+    # Last-access time for disk eviction, shared by all workers via the
+    # catalog; written at most once a minute per study per process
+    now = time.time()
+    if now - study_access.get(study_id, 0) < ACCESS_TOUCH_INTERVAL:
+        return
+    study_access[study_id] = now
+    try:
+        with catalog_db() as conn:
+            conn.execute("UPDATE studies SET accessed_at = ? WHERE study_id = ?", (now, study_id))
+    except sqlite3.Error:
+        pass
+
+def catalog_access_times():
+    with catalog_db() as conn:
+        rows = conn.execute("SELECT study_id, MAX(accessed_at, updated_at) AS last FROM studies").fetchall()
+    return {row["study_id"]: row["last"] for row in rows}
+
+def catalog_find_study_uid(study_uid: str, exclude: str):
+    # Oldest ready study with this StudyInstanceUID, to append uploads to
+    with catalog_db() as conn:
+        row = conn.execute(
+            "SELECT study_id FROM studies WHERE study_uid = ? AND study_id != ? AND status = 'ready' ORDER BY id LIMIT 1",
+            (study_uid, exclude),
+        ).fetchone()
+    return row["study_id"] if row else None
+
+def catalog_delete(study_id: str):
+    with catalog_db() as conn:
+        conn.execute("DELETE FROM studies WHERE study_id = ?", (study_id,))
+
+def allocate_study_id():
+    # AUTOINCREMENT never hands out an id twice, even after deletes, so two
+    # concurrent uploads (or workers) can't land in the same directory.
+    while True:
+        with catalog_db() as conn:
+            now = time.time()
+            cur = conn.execute(
+                "INSERT INTO studies (study_id, status, created_at, updated_at) VALUES (?, 'queued', ?, ?)",
+                (f"allocating-{now}-{threading.get_ident()}", now, now),
+            )
+            study_id = str(cur.lastrowid)
+            if os.path.exists(get_study_dir(study_id)):
+                conn.execute("DELETE FROM studies WHERE id = ?", (cur.lastrowid,))
+                continue
+            conn.execute("UPDATE studies SET study_id = ? WHERE id = ?", (study_id, cur.lastrowid))
+        os.makedirs(get_study_dir(study_id))
+        return study_id
+
+def like_pattern(text):
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def study_summary(row):
+    return {
+        "study_id": row["study_id"],
+        "patientName": row["patient_name"],
+        "studyDate": row["study_date"],
+        "description": row["description"],
+        "status": row["status"],
+        "numSeries": row["num_series"],
+        "numImages": row["num_images"],
+    }
+
 def make_json_serializable(obj):
     if isinstance(obj, (str, int, float, bool, type(None))):
         return obj
@@ -209,137 +1419,445 @@ def iter_file_chunks(file_path, chunk_size=8192):
                 break
             yield chunk
 
+def parse_byte_range(request: Request, total: int, etag: str):
+    # Single "bytes=a-b" ranges only; anything else gets the full body
+    header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if not header or (if_range and if_range != etag):
+        return None
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), total - 1) if match.group(2) else total - 1
+    else:
+        start, end = max(total - int(match.group(2)), 0), total - 1
+    if start >= total or start > end:
+        raise HTTPException(
+            416, headers={"Content-Range": f"bytes */{total}"},
+        )
+    return start, end
+
+def zip_export_response(request: Request, files, filename):
+    # Streamed as ZIP_STORED entries: nothing touches /tmp and the first bytes
+    # go out immediately, with an exact Content-Length computed from stat().
+    # The layout is deterministic, so interrupted downloads can resume by Range.
+    entries = plan_stored_zip(files)
+    total = stored_zip_size(entries)
+    etag = stored_zip_etag(entries)
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Content-Length": str(total),
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+    }
+    byte_range = parse_byte_range(request, total, etag)
+    if byte_range is None:
+        return StreamingResponse(timed_iter("zip_stream", iter_stored_zip(entries)), media_type="application/zip", headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start + 1)
+    headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+    return StreamingResponse(
+        timed_iter("zip_stream", iter_byte_range(iter_stored_zip(entries), start, end)),
+        status_code=status.HTTP_206_PARTIAL_CONTENT, media_type="application/zip", headers=headers,
+    )
+
+def cine_frame_size(study_id: str, images, size=None):
+    width, height = images[0]["Columns"], images[0]["Rows"]
+    if size:
+        scale = size / max(width, height)
+        width, height = width * scale, height * scale
+    # libx264 with yuv420p needs even dimensions
+    return max(2, int(round(width / 2)) * 2), max(2, int(round(height / 2)) * 2)
+
+def iter_cine_frames(study_id: str, series_list, wl, frame_size):
+    study_dir = get_study_dir(study_id)
+    for series in series_list:
+        pack = get_series_pack(study_id, series["series_id"])
+        for img in series["images"]:
+            if wl is None:
+                # Slices evicted by maintenance are rendered again here
+                try:
+                    data = read_slice_jpeg(study_id, series["series_id"], img)
+                except HTTPException:
+                    continue
+                frame = Image.open(io.BytesIO(data))
+            else:
+                pixels = pack.pixels(pixel_pack_name(img)) if pack is not None else None
+                if pixels is None:
+                    dcm_path = os.path.join(study_dir, img["filename"])
+                    if not os.path.exists(dcm_path):
+                        continue
+                    pixels = read_frame_pixels(dcm_path, img.get("frame"))
+                frame = Image.fromarray(apply_window(pixels, *wl))
+            frame = frame.convert("RGB")
+            if frame.size != frame_size:
+                frame = frame.resize(frame_size, Image.BILINEAR)
+            yield np.asarray(frame)
+
+def encode_cine(frames, mp4_path, frame_size, fps):
+    # One frame in flight at a time; memory does not grow with series length
+    tmp_path = mp4_path + ".tmp.mp4"
+    writer = FFMPEG_VideoWriter(tmp_path, frame_size, fps, codec="libx264", ffmpeg_params=["-pix_fmt", "yuv420p"])
+    count = 0
+    try:
+        for frame in frames:
+            writer.write_frame(frame)
+            count += 1
+    finally:
+        writer.close()
+    if not count:
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, mp4_path)
+    return True
+
+def cine_export_response(study_id: str, series_list, filename, fps, wl_params, size=None):
+    if not MOVIEPY_AVAILABLE:
+        raise HTTPException(500, "moviepy not installed on server")
+    images = [img for series in series_list for img in series["images"]]
+    if not images:
+        raise HTTPException(404, "No JPEGs found for MP4 export")
+    wl = resolve_window(images[0], *wl_params)
+    frame_size = cine_frame_size(study_id, images, size)
+    cine_key = hashlib.sha1(json.dumps([
+        [s["series_id"] for s in series_list], [img["image_id"] for img in images], fps, wl, frame_size,
+    ]).encode()).hexdigest()
+    mp4_path = os.path.join(get_cine_dir(study_id), f"{cine_key}.mp4")
+    with cine_lock:
+        key_lock = cine_locks.setdefault(mp4_path, threading.Lock())
+    with key_lock:
+        if not os.path.exists(mp4_path):
+            os.makedirs(get_cine_dir(study_id), exist_ok=True)
+            if not encode_cine(iter_cine_frames(study_id, series_list, wl, frame_size), mp4_path, frame_size, fps):
+                raise HTTPException(404, "No JPEGs found for MP4 export")
+    return FileResponse(mp4_path, filename=filename, media_type="video/mp4")
+
+def disk_usage_snapshot():
+    # Bytes per derived kind plus eviction units, one per (study, kind)
+    access = catalog_access_times()
+    usage = {name: 0 for name in DERIVED_DIRNAMES}
+    units = []
+    for study_id in os.listdir(UPLOAD_ROOT):
+        study_dir = get_study_dir(study_id)
+        if not os.path.isdir(study_dir):
+            continue
+        last = access.get(study_id) or os.path.getmtime(study_dir)
+        for priority, name in enumerate(DERIVED_DIRNAMES):
+            size = dir_size(os.path.join(study_dir, name))
+            if size:
+                usage[name] += size
+                units.append({
+                    "study_id": study_id, "kind": name, "last_access": last,
+                    "path": os.path.join(study_dir, name), "bytes": size, "rank": (last, priority),
+                })
+    return usage, units
+
+@timed("maintenance")
+def maintenance_pass():
+    """
+    Sweep stale temp files and orphaned pack generations, then evict derived
+    artifacts of the least-recently-accessed studies until derived bytes are
+    within DICOM_DISK_BUDGET_MB and free space is above DICOM_DISK_MIN_FREE_MB.
+    """
+    started = time.time()
+    # Only our own outputs: source uploads are sniffed by content and may
+    # legitimately be named *.tmp
+    temp_files = temp_bytes = 0
+    for study_id in os.listdir(UPLOAD_ROOT):
+        for name in DERIVED_DIRNAMES:
+            files, size = sweep_temp_files(os.path.join(get_study_dir(study_id), name), TEMP_MAX_AGE, started)
+            temp_files, temp_bytes = temp_files + files, temp_bytes + size
+        size = remove_stale_file(get_metadata_path(study_id) + ".tmp", TEMP_MAX_AGE, started)
+        temp_files, temp_bytes = temp_files + bool(size), temp_bytes + size
+        for path in stale_pack_files(get_pack_dir(study_id)):
+            if started - os.path.getmtime(path) > TEMP_MAX_AGE:
+                size = remove_file(path)
+                temp_files, temp_bytes = temp_files + bool(size), temp_bytes + size
+
+    usage, units = disk_usage_snapshot()
+    needed = 0
+    if DISK_BUDGET_BYTES:
+        needed = max(needed, sum(usage.values()) - DISK_BUDGET_BYTES)
+    if DISK_MIN_FREE_BYTES:
+        needed = max(needed, DISK_MIN_FREE_BYTES - shutil.disk_usage(UPLOAD_ROOT).free)
+
+    def on_evict(unit):
+        # Recently used studies (including ones still ingesting) are left alone
+        if started - unit["last_access"] < EVICT_MIN_IDLE or ingest_active(unit["study_id"]):
+            return False
+        evict_study_caches(unit["study_id"])
+        usage[unit["kind"]] -= unit["bytes"]
+        return True
+
+    evicted, evicted_bytes = evict_lru(units, needed, on_evict) if needed > 0 else (0, 0)
+    inc_counter("dicom_disk_reclaimed_bytes_total", temp_bytes, reason="temp")
+    inc_counter("dicom_disk_reclaimed_bytes_total", evicted_bytes, reason="evict")
+    if evicted_bytes or temp_bytes:
+        logger.info("maintenance: evicted %d artifacts (%d bytes), removed %d temp files (%d bytes)",
+                    evicted, evicted_bytes, temp_files, temp_bytes)
+    return {
+        "finished_at": time.time(),
+        "duration_s": round(time.time() - started, 3),
+        "reclaimed_bytes": evicted_bytes + temp_bytes,
+        "evicted": evicted,
+        "evicted_bytes": evicted_bytes,
+        "temp_files_removed": temp_files,
+        "temp_bytes_removed": temp_bytes,
+        "usage": {
+            "derived_bytes": sum(usage.values()),
+            "by_kind": usage,
+            "render_cache_bytes": shared_cache.stats()["bytes"] if shared_cache is not None else 0,
+            "free_bytes": shutil.disk_usage(UPLOAD_ROOT).free,
+            "budget_bytes": DISK_BUDGET_BYTES,
+            "min_free_bytes": DISK_MIN_FREE_BYTES,
+        },
+    }
+
+def run_maintenance():
+    # One pass across all workers at a time; the others skip (None)
+    with open(CATALOG_PATH + ".maintenance.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return None
+        try:
+            report = maintenance_pass()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    with maintenance_lock:
+        maintenance_report.clear()
+        maintenance_report.update(report)
+    return report
+
+def maintenance_loop():
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL)
+        try:
+            run_maintenance()
+        except Exception:
+            logger.exception("maintenance pass failed")
+
+@app.on_event("startup")
+def start_maintenance():
+    if os.path.isdir(UPLOAD_ROOT):
+        recover_interrupted_ingests()
+    if MAINTENANCE_INTERVAL > 0:
+        threading.Thread(target=maintenance_loop, name="disk-maintenance", daemon=True).start()
+
+@app.get("/maintenance")
+def get_maintenance_report():
+    with maintenance_lock:
+        report = dict(maintenance_report)
+    return {"last_run": report or None, "interval_s": MAINTENANCE_INTERVAL}
+
+@app.post("/maintenance/run")
+def post_maintenance_run():
+    report = run_maintenance()
+    if report is None:
+        raise HTTPException(409, "Maintenance is already running in another worker")
+    return report
+
+async def timing_header(request: Request, call_next):
+    stages = []
+    token = request_stages.set(stages)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_stages.reset(token)
+    response.headers["Server-Timing"] = server_timing(stages, time.perf_counter() - start)
+    return response
+
+if TIMING_HEADER:
+    # Only registered when enabled: the HTTP middleware wraps every response,
+    # streamed exports included, in an extra task and stream hop
+    app.middleware("http")(timing_header)
+
+os.makedirs(UPLOAD_ROOT, exist_ok=True)
+init_catalog()
 app.mount("/images", StaticFiles(directory=UPLOAD_ROOT), name="images")
 
 @app.get("/studies/{study_id}/series/{series_id}/export/file")
-def export_series_file(study_id: str, series_id: str, format: str = Query("jpeg")):
+@timed("export_series")
+def export_series_file(
+    request: Request,
+    study_id: str,
+    series_id: str,
+    format: str = Query("jpeg"),
+    fps: int = Query(12, ge=1, le=60),
+    window: float = Query(None),
+    level: float = Query(None),
+    preset: str = Query(None),
+    size: int = Query(None, ge=16, le=4096),
+):
     study_dir = get_study_dir(study_id)
-    jpeg_dir = get_jpeg_dir(study_id)
-    meta_json = load_metadata_json(study_id)
-    if not meta_json:
-        raise HTTPException(404, "Study not found")
-    series = next((s for s in meta_json["series"] if s["series_id"] == series_id), None)
-    if not series:
-        raise HTTPException(404, "Series not found")
+    entry = require_study(study_id)
+    meta_json = entry["meta"]
+    series = find_series(entry, series_id)
     series_folder = safe_name(series["seriesDescription"])
     patient_folder = f"{safe_name(meta_json['patientName'])}_{safe_name(meta_json['studyDate'])}_{safe_name(meta_json['description'])}"
 
     if format == "jpeg":
         # Export all JPEGs as a zip
-        temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        with zipfile.ZipFile(temp_zip, "w") as zipf:
-            for img in series["images"]:
-                jpeg_path = os.path.join(jpeg_dir, img["jpeg_filename"])
-                if os.path.exists(jpeg_path):
-                    zipf.write(jpeg_path, arcname=img["jpeg_filename"])
-        temp_zip.close()
-        return FileResponse(temp_zip.name, filename=f"{patient_folder}_{series_folder}.zip", media_type="application/zip")
+        return zip_export_response(
+            request,
+            series_jpeg_files(study_id, series),
+            f"{patient_folder}_{series_folder}.zip",
+        )
     elif format == "dicom":
         # Export all DICOMs as a zip
-        temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        with zipfile.ZipFile(temp_zip, "w") as zipf:
-            for img in series["images"]:
-                dcm_path = os.path.join(study_dir, img["filename"])
-                if os.path.exists(dcm_path):
-                    zipf.write(dcm_path, arcname=img["filename"])
-        temp_zip.close()
-        return FileResponse(temp_zip.name, filename=f"{patient_folder}_{series_folder}_dicom.zip", media_type="application/zip")
+        return zip_export_response(
+            request,
+            [(img["filename"], os.path.join(study_dir, img["filename"])) for img in source_images(series["images"])],
+            f"{patient_folder}_{series_folder}_dicom.zip",
+        )
     elif format == "mp4":
-        if not MOVIEPY_AVAILABLE:
-            raise HTTPException(500, "moviepy not installed on server")
-        frames = []
-        for img in series["images"]:
-            jpeg_path = os.path.join(jpeg_dir, img["jpeg_filename"])
-            if os.path.exists(jpeg_path):
-                frames.append(np.array(Image.open(jpeg_path)))
-        if not frames:
-            raise HTTPException(404, "No JPEGs found for MP4 export")
-        tempdir = tempfile.mkdtemp()
-        try:
-            mp4_path = os.path.join(tempdir, f"{series_folder}.mp4")
-            clip = mpy.ImageSequenceClip(frames, fps=12)
-            clip.write_videofile(mp4_path, codec="libx264", fps=12, audio=False, verbose=False, logger=None)
-            filename = f"{patient_folder}_{series_folder}.mp4"
-            return FileResponse(mp4_path, filename=filename, media_type="video/mp4")
-        finally:
-            shutil.rmtree(tempdir)
+        return cine_export_response(study_id, [series], f"{patient_folder}_{series_folder}.mp4", fps, (window, level, preset), size)
     else:
         raise HTTPException(400, "Invalid format requested")
 
 @app.get("/studies/{study_id}/export/file")
-def export_study_file(study_id: str, format: str = Query("jpeg")):
+@timed("export_study")
+def export_study_file(
+    request: Request,
+    study_id: str,
+    format: str = Query("jpeg"),
+    fps: int = Query(12, ge=1, le=60),
+    window: float = Query(None),
+    level: float = Query(None),
+    preset: str = Query(None),
+    size: int = Query(None, ge=16, le=4096),
+):
     study_dir = get_study_dir(study_id)
-    jpeg_dir = get_jpeg_dir(study_id)
-    meta_json = load_metadata_json(study_id)
-    if not meta_json:
-        raise HTTPException(404, "Study not found")
+    meta_json = require_study(study_id)["meta"]
     patient_folder = f"{safe_name(meta_json['patientName'])}_{safe_name(meta_json['studyDate'])}_{safe_name(meta_json['description'])}"
     if format == "jpeg":
-        temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        with zipfile.ZipFile(temp_zip, "w") as zipf:
-            for series in meta_json["series"]:
-                series_folder = safe_name(series["seriesDescription"])
-                for img in series["images"]:
-                    jpeg_path = os.path.join(jpeg_dir, img["jpeg_filename"])
-                    if os.path.exists(jpeg_path):
-                        zipf.write(jpeg_path, arcname=f"{series_folder}/{img['jpeg_filename']}")
-        temp_zip.close()
-        return FileResponse(temp_zip.name, filename=f"{patient_folder}.zip", media_type="application/zip")
+        return zip_export_response(
+            request,
+            [
+                entry for series in meta_json["series"]
+                for entry in series_jpeg_files(study_id, series, f"{safe_name(series['seriesDescription'])}/")
+            ],
+            f"{patient_folder}.zip",
+        )
     elif format == "dicom":
-        temp_zip = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
-        with zipfile.ZipFile(temp_zip, "w") as zipf:
-            for series in meta_json["series"]:
-                series_folder = safe_name(series["seriesDescription"])
-                for img in series["images"]:
-                    dcm_path = os.path.join(study_dir, img["filename"])
-                    if os.path.exists(dcm_path):
-                        zipf.write(dcm_path, arcname=f"{series_folder}/{img['filename']}")
-        temp_zip.close()
-        return FileResponse(temp_zip.name, filename=f"{patient_folder}_dicom.zip", media_type="application/zip")
+        return zip_export_response(
+            request,
+            [
+                (f"{safe_name(series['seriesDescription'])}/{img['filename']}", os.path.join(study_dir, img["filename"]))
+                for series in meta_json["series"] for img in source_images(series["images"])
+            ],
+            f"{patient_folder}_dicom.zip",
+        )
     elif format == "mp4":
-        if not MOVIEPY_AVAILABLE:
-            raise HTTPException(500, "moviepy not installed on server")
-        frames = []
-        for series in meta_json["series"]:
-            for img in series["images"]:
-                jpeg_path = os.path.join(jpeg_dir, img["jpeg_filename"])
-                if os.path.exists(jpeg_path):
-                    frames.append(np.array(Image.open(jpeg_path)))
-        if not frames:
-            raise HTTPException(404, "No JPEGs found for MP4 export")
-        tempdir = tempfile.mkdtemp()
-        try:
-            mp4_path = os.path.join(tempdir, f"{patient_folder}.mp4")
-            clip = mpy.ImageSequenceClip(frames, fps=12)
-            clip.write_videofile(mp4_path, codec="libx264", fps=12, audio=False, verbose=False, logger=None)
-            filename = f"{patient_folder}.mp4"
-            return FileResponse(mp4_path, filename=filename, media_type="video/mp4")
-        finally:
-            shutil.rmtree(tempdir)
+        return cine_export_response(study_id, meta_json["series"], f"{patient_folder}.mp4", fps, (window, level, preset), size)
     else:
         raise HTTPException(400, "Invalid format requested")
 
+@app.get("/cache/stats")
+def get_cache_stats():
+    stats = {}
+    with cache_lock:
+        for name, cache in (("jpeg", jpeg_cache), ("mpr", mpr_cache), ("pixel", pixel_cache)):
+            counters = cache_stats[name]
+            lookups = counters["hits"] + counters["misses"]
+            stats[name] = {
+                "hits": counters["hits"],
+                "misses": counters["misses"],
+                "hit_ratio": counters["hits"] / lookups if lookups else 0.0,
+                "entries": len(cache),
+                "bytes": cache.currsize,
+                "max_bytes": cache.maxsize,
+            }
+        shared_counters = dict(cache_stats["shared"])
+    if shared_cache is not None:
+        lookups = shared_counters["hits"] + shared_counters["misses"]
+        stats["shared"] = dict(
+            shared_counters,
+            hit_ratio=shared_counters["hits"] / lookups if lookups else 0.0,
+            **shared_cache.stats(),
+        )
+    return stats
+
+@app.get("/metrics")
+def get_metrics():
+    caches = (("jpeg", jpeg_cache), ("mpr", mpr_cache), ("pixel", pixel_cache))
+    with cache_lock:
+        cache_samples = [(name, dict(cache_stats[name]), len(cache), cache.currsize, cache.maxsize) for name, cache in caches]
+        shared_counters = dict(cache_stats["shared"])
+    if shared_cache is not None:
+        shared_stats = shared_cache.stats()
+        cache_samples.append(("shared", shared_counters, shared_stats["entries"], shared_stats["bytes"], shared_stats["max_bytes"]))
+    with maintenance_lock:
+        disk_report = dict(maintenance_report)
+    with ingest_lock:
+        states = {}
+        for job in ingest_jobs.values():
+            states[job["state"]] = states.get(job["state"], 0) + 1
+    executor_samples = [(n, executor_load(n)) for n in ("ingest_jobs", "ingest_pool")]
+    families = [
+        ("dicom_cache_hits_total", "counter", "Cache lookups that hit.", [({"cache": n}, c["hits"]) for n, c, *_ in cache_samples]),
+        ("dicom_cache_misses_total", "counter", "Cache lookups that missed.", [({"cache": n}, c["misses"]) for n, c, *_ in cache_samples]),
+        ("dicom_cache_hit_ratio", "gauge", "Hits over lookups since start.", [
+            ({"cache": n}, round(c["hits"] / (c["hits"] + c["misses"]), 4) if c["hits"] + c["misses"] else 0.0)
+            for n, c, *_ in cache_samples
+        ]),
+        ("dicom_cache_entries", "gauge", "Entries held.", [({"cache": n}, e) for n, _, e, _, _ in cache_samples]),
+        ("dicom_cache_bytes", "gauge", "Bytes held.", [({"cache": n}, b) for n, _, _, b, _ in cache_samples]),
+        ("dicom_cache_max_bytes", "gauge", "Byte budget.", [({"cache": n}, m) for n, _, _, _, m in cache_samples]),
+        ("dicom_ingest_jobs", "gauge", "Tracked ingest jobs by state.", [({"state": k}, v) for k, v in sorted(states.items())]),
+        ("dicom_disk_derived_bytes", "gauge", "Derived artifact bytes at the last maintenance pass.", [
+            ({"kind": k}, v) for k, v in sorted(disk_report.get("usage", {}).get("by_kind", {}).items())
+        ]),
+        ("dicom_executor_queue_depth", "gauge", "Work items waiting for a worker.", [
+            ({"executor": n}, queued) for n, (queued, _) in executor_samples
+        ]),
+        ("dicom_executor_active", "gauge", "Work items running.", [
+            ({"executor": n}, running) for n, (_, running) in executor_samples
+        ]),
+        ("dicom_executor_max_workers", "gauge", "Worker limit.", [
+            ({"executor": "ingest_jobs"}, INGEST_JOBS),
+            ({"executor": "ingest_pool"}, INGEST_PROCESSES if INGEST_PROCESSES > 0 else MAX_WORKERS),
+        ]),
+    ]
+    return PlainTextResponse(render_metrics(families), media_type="text/plain; version=0.0.4")
+
+@app.get("/window_presets")
+def list_window_presets():
+    return {name: {"window": w, "level": l} for name, (w, l) in WINDOW_PRESETS.items()}
+
 @app.get("/studies/{study_id}/series/{series_id}/image/{image_id}")
-def get_series_image(study_id: str, series_id: str, image_id: str, format: str = Query("jpeg")):
+def get_series_image(
+    request: Request,
+    study_id: str,
+    series_id: str,
+    image_id: str,
+    format: str = Query("jpeg"),
+    window: float = Query(None),
+    level: float = Query(None),
+    preset: str = Query(None),
+    size: int = Query(None, ge=1),
+    frame: int = Query(None, ge=0),
+    rev: int = Query(None),
+):
     study_dir = get_study_dir(study_id)
-    jpeg_dir = get_jpeg_dir(study_id)
-    meta_json = load_metadata_json(study_id)
-    if not meta_json:
-        raise HTTPException(404, "Study not found")
-    series = next((s for s in meta_json["series"] if s["series_id"] == series_id), None)
-    if not series:
-        raise HTTPException(404, "Series not found")
-    image = next((img for img in series["images"] if img["image_id"] == image_id), None)
-    if not image:
-        raise HTTPException(404, "Image not found")
+    entry = require_study(study_id)
+    if frame is None:
+        image = find_image(entry, series_id, image_id)
+    else:
+        image = find_frame(entry, series_id, image_id, frame)
     if format == "jpeg":
-        jpeg_path = os.path.join(jpeg_dir, image["jpeg_filename"])
-        if not os.path.exists(jpeg_path):
-            dcm_path = os.path.join(study_dir, image["filename"])
-            if not os.path.exists(dcm_path):
-                raise HTTPException(404, "DICOM not found")
-            dcm2jpeg(dcm_path, jpeg_path)
-        return FileResponse(jpeg_path, media_type="image/jpeg")
+        wl = resolve_window(image, window, level, preset)
+        size = pyramid_level(image, size)
+        return cached_jpeg_response(
+            request, "jpeg", jpeg_cache, jpeg_cache_key(study_id, series_id, image, wl, size),
+            lambda: render_slice_jpeg(study_id, series_id, image, wl, size),
+            shared=wl is not None,
+            # Cacheable for good only when the URL names the current revision
+            cache_control=IMAGE_CACHE_CONTROL if rev == image_revision(image) else MUTABLE_CACHE_CONTROL,
+        )
     elif format == "dicom":
         dcm_path = os.path.join(study_dir, image["filename"])
         if not os.path.exists(dcm_path):
@@ -348,62 +1866,249 @@ def get_series_image(study_id: str, series_id: str, image_id: str, format: str =
     else:
         raise HTTPException(400, "Invalid format")
 
+@app.get("/studies/{study_id}/series/{series_id}/images")
+def get_series_images_batch(
+    study_id: str,
+    series_id: str,
+    start: int = Query(0, ge=0),
+    count: int = Query(None, ge=1),
+    window: float = Query(None),
+    level: float = Query(None),
+    preset: str = Query(None),
+    size: int = Query(None, ge=1),
+    quality: int = Query(None, ge=1, le=100),
+):
+    # One multipart/related response per range of slices (DICOMweb-style), so
+    # a client can warm a whole series in a single round trip.
+    series = find_series(require_study(study_id), series_id)
+    images = series["images"][start:start + count if count else None]
+    # Resolved up front: once streaming starts a bad preset can no longer be a 400
+    windows = [resolve_window(image, window, level, preset) for image in images]
+    boundary = hashlib.md5(f"{study_id}:{series_id}:{time.time()}".encode()).hexdigest()
+
+    def parts():
+        for index, (image, wl) in enumerate(zip(images, windows), start):
+            level_size = pyramid_level(image, size)
+            try:
+                jpeg_bytes, etag = cached_jpeg_entry(
+                    "jpeg", jpeg_cache, jpeg_cache_key(study_id, series_id, image, wl, level_size, quality),
+                    lambda: render_slice_jpeg(study_id, series_id, image, wl, level_size, quality),
+                    shared=wl is not None or bool(quality),
+                )
+            except HTTPException:
+                # Missing source slice; the client sees the gap in X-Slice-Index
+                continue
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: image/jpeg\r\n"
+                f"Content-Length: {len(jpeg_bytes)}\r\n"
+                f"Content-ID: <{image['image_id']}>\r\n"
+                f"X-Slice-Index: {index}\r\n"
+                f"ETag: {etag}\r\n\r\n"
+            ).encode() + jpeg_bytes + b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(
+        parts(),
+        media_type=f'multipart/related; type="image/jpeg"; boundary={boundary}',
+        headers={"X-Slice-Count": str(len(images))},
+    )
+
+@app.get("/studies/{study_id}/mpr_info")
+def get_mpr_info(study_id: str, orientation: str = Query("axial"), series_id: str = Query(None)):
+    if orientation not in MPR_ORIENTATIONS:
+        raise HTTPException(400, "Invalid orientation")
+    series = select_mpr_series(study_id, series_id)
+    volume = get_mpr_volume(study_id, series)
+    return {
+        "study_id": study_id,
+        "series_id": series["series_id"],
+        "orientation": orientation,
+        "num_slices": mpr_num_slices(volume, orientation),
+        "shape": volume["shape"],
+        "spacing": volume["spacing"],
+        "WindowCenter": volume["level"],
+        "WindowWidth": volume["window"],
+    }
+
+@app.get("/studies/{study_id}/mpr")
+def get_mpr_image(
+    request: Request,
+    study_id: str,
+    orientation: str = Query("axial"),
+    slice_index: int = Query(0),
+    series_id: str = Query(None),
+    window: float = Query(None),
+    level: float = Query(None),
+    preset: str = Query(None),
+):
+    if orientation not in MPR_ORIENTATIONS:
+        raise HTTPException(400, "Invalid orientation")
+    series = select_mpr_series(study_id, series_id)
+    wl = resolve_window(series["images"][0], window, level, preset)
+    cache_key = mpr_cache_key(study_id, series, orientation, slice_index, wl)
+
+    def render():
+        volume = get_mpr_volume(study_id, series)
+        if not 0 <= slice_index < mpr_num_slices(volume, orientation):
+            raise HTTPException(400, "slice_index out of range")
+        return render_mpr_slice(volume, orientation, slice_index, wl)
+
+    return cached_jpeg_response(request, "mpr", mpr_cache, cache_key, render, cache_control=MUTABLE_CACHE_CONTROL)
+
+@app.get("/studies/{study_id}/series/{series_id}/projection")
+def get_series_projection(
+    request: Request,
+    study_id: str,
+    series_id: str,
+    orientation: str = Query("axial"),
+    slice_index: int = Query(0),
+    thickness: float = Query(10.0, gt=0, le=1000),
+    mode: str = Query("mip"),
+    window: float = Query(None),
+    level: float = Query(None),
+    preset: str = Query(None),
+):
+    # Thick-slab MIP/MinIP/average centred on slice_index of the MPR volume
+    if orientation not in MPR_ORIENTATIONS:
+        raise HTTPException(400, "Invalid orientation")
+    if mode not in PROJECTION_MODES:
+        raise HTTPException(400, "Invalid mode")
+    series = select_mpr_series(study_id, series_id)
+    volume = get_mpr_volume(study_id, series)
+    if not 0 <= slice_index < mpr_num_slices(volume, orientation):
+        raise HTTPException(400, "slice_index out of range")
+    wl = resolve_window(series["images"][0], window, level, preset)
+    slab = projection_slab(volume, orientation, slice_index, thickness)
+    return cached_jpeg_response(
+        request, "mpr", mpr_cache, projection_cache_key(study_id, series, orientation, mode, slab, wl),
+        lambda: render_projection(volume, orientation, slab, mode, wl),
+        cache_control=MUTABLE_CACHE_CONTROL,
+    )
+
 @app.delete("/studies/{study_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_study(study_id: str):
     study_dir = get_study_dir(study_id)
     if not os.path.exists(study_dir):
         raise HTTPException(404, "Study not found")
+    if ingest_active(study_id):
+        raise HTTPException(409, "Study is still being ingested")
+    evict_study_caches(study_id)
+    invalidate_study_index(study_id)
+    with ingest_lock:
+        ingest_jobs.pop(study_id, None)
+    catalog_delete(study_id)
     try:
         shutil.rmtree(study_dir)
     except Exception as e:
         raise HTTPException(500, f"Failed to delete study: {e}")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
+@app.post("/studies/{study_id}/pack")
+def pack_study_files(study_id: str):
+    # Compact an already-ingested study on demand (DICOM_PACK_SERIES does it at ingest)
+    meta_json = require_study(study_id)["meta"]
+    if ingest_active(study_id):
+        raise HTTPException(409, "Study is still being ingested")
+    return {"study_id": study_id, "series": pack_study(study_id, meta_json)}
+
 @app.post("/upload/")
 async def upload_files(files: List[UploadFile] = File(...)):
     os.makedirs(UPLOAD_ROOT, exist_ok=True)
-    study_id = str(len([d for d in os.listdir(UPLOAD_ROOT) if os.path.isdir(os.path.join(UPLOAD_ROOT, d))]) + 1)
+    # The catalog and metadata writes block (SQLite busy timeout), so none
+    # of them run on the event loop
+    study_id = await run_in_threadpool(allocate_study_id)
     study_dir = get_study_dir(study_id)
-    os.makedirs(study_dir, exist_ok=True)
-    for file in files:
-        file_location = os.path.join(study_dir, file.filename)
-        os.makedirs(os.path.dirname(file_location), exist_ok=True)
-        with open(file_location, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-    build_metadata_json(study_id, study_dir)
-    return JSONResponse({"status": "ok", "study_id": study_id})
+    try:
+        await run_in_threadpool(reserve_ingest, study_id)
+    except HTTPException:
+        await run_in_threadpool(discard_upload, study_id)
+        raise
+    try:
+        for file in files:
+            await run_in_threadpool(save_upload, file, os.path.join(study_dir, file.filename))
+    except Exception as e:
+        set_ingest_state(study_id, "failed", error=str(e))
+        await run_in_threadpool(discard_upload, study_id)
+        raise HTTPException(500, f"Failed to store upload: {e}")
+    await run_in_threadpool(submit_ingest, study_id)
+    return JSONResponse({"status": "ok", "study_id": study_id, "ingest": "queued"})
 
 @app.post("/upload_zip/")
 async def upload_zip(file: UploadFile = File(...)):
     os.makedirs(UPLOAD_ROOT, exist_ok=True)
-    study_id = str(len([d for d in os.listdir(UPLOAD_ROOT) if os.path.isdir(os.path.join(UPLOAD_ROOT, d))]) + 1)
+    study_id = await run_in_threadpool(allocate_study_id)
     study_dir = get_study_dir(study_id)
-    os.makedirs(study_dir, exist_ok=True)
+    try:
+        await run_in_threadpool(reserve_ingest, study_id)
+    except HTTPException:
+        await run_in_threadpool(discard_upload, study_id)
+        raise
     zip_path = os.path.join(study_dir, file.filename)
-    with open(zip_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
     try:
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(study_dir)
-        os.remove(zip_path)
-        build_metadata_json(study_id, study_dir)
+        await run_in_threadpool(save_upload, file, zip_path)
+        if not await run_in_threadpool(zipfile.is_zipfile, zip_path):
+            raise ValueError("not a zip archive")
     except Exception as e:
-        shutil.rmtree(study_dir)
+        set_ingest_state(study_id, "failed", error=str(e))
+        await run_in_threadpool(discard_upload, study_id)
         raise HTTPException(400, detail=f"Failed to extract zip: {e}")
-    return {"status": "ok", "study_id": study_id}
+    await run_in_threadpool(submit_ingest, study_id, zip_path)
+    return {"status": "ok", "study_id": study_id, "ingest": "queued"}
+
+@app.get("/studies/{study_id}/ingest")
+def get_ingest_status(study_id: str):
+    with ingest_lock:
+        job = ingest_jobs.get(study_id)
+        job = dict(job) if job else None
+    if job is None:
+        entry = load_study_index(study_id)
+        if not entry:
+            raise HTTPException(404, "Study not found")
+        images = sum(len(s["images"]) for s in entry["meta"]["series"])
+        job = {"state": entry["meta"].get("status", "ready"), "done": images, "total": images, "error": None}
+    return dict(job, study_id=study_id)
 
 @app.get("/studies")
-def list_studies():
-    studies = []
-    if os.path.exists(UPLOAD_ROOT):
-        for study_folder in sorted(os.listdir(UPLOAD_ROOT)):
-            study_dir = get_study_dir(study_folder)
-            if os.path.isdir(study_dir):
-                meta_json = load_metadata_json(study_folder)
-                if not meta_json:
-                    meta_json = build_metadata_json(study_folder, study_dir)
-                studies.append(meta_json)
-    if not studies:
+def list_studies(
+    q: str = Query(None),
+    patient: str = Query(None),
+    description: str = Query(None),
+    date_from: str = Query(None),
+    date_to: str = Query(None),
+    sort: str = Query("date"),
+    order: str = Query("desc"),
+    page: int = Query(1, ge=1),
+    limit: int = Query(50, ge=1, le=500),
+):
+    if sort not in CATALOG_SORT_COLUMNS or order not in ("asc", "desc"):
+        raise HTTPException(400, "Invalid sort")
+    where, params = [], []
+    if q:
+        where.append("(patient_name LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\' OR study_date LIKE ? ESCAPE '\\')")
+        params += [like_pattern(q)] * 3
+    if patient:
+        where.append("patient_name LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(patient))
+    if description:
+        where.append("description LIKE ? ESCAPE '\\'")
+        params.append(like_pattern(description))
+    if date_from:
+        where.append("study_date >= ?")
+        params.append(date_from)
+    if date_to:
+        where.append("study_date <= ?")
+        params.append(date_to)
+    clause = f"WHERE {' AND '.join(where)}" if where else ""
+    with catalog_db() as conn:
+        total = conn.execute(f"SELECT COUNT(*) FROM studies {clause}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM studies {clause} ORDER BY {CATALOG_SORT_COLUMNS[sort]} {order}, id {order} LIMIT ? OFFSET ?",
+            params + [limit, (page - 1) * limit],
+        ).fetchall()
+    studies = [study_summary(row) for row in rows]
+    headers = {"X-Total-Count": str(total), "X-Page": str(page), "X-Page-Size": str(limit)}
+    if not studies and total == 0 and not where:
         studies.append({
             "study_id": "demo",
             "patientName": "Demo Patient",
@@ -449,14 +2154,15 @@ def list_studies():
             ],
             "ai_analysis": None
         })
-    return JSONResponse(make_json_serializable(studies))
+    return JSONResponse(make_json_serializable(studies), headers=headers)
 
 @app.get("/studies/{study_id}")
 def get_study_detail(study_id: str):
     study_dir = get_study_dir(study_id)
     if not os.path.exists(study_dir):
         raise HTTPException(404, "Study not found")
-    meta_json = load_metadata_json(study_id)
-    if not meta_json:
-        meta_json = build_metadata_json(study_id, study_dir)
-    return JSONResponse(make_json_serializable(meta_json))
\ No newline at end of file
+    entry = load_study_index(study_id)
+    if not entry:
+        build_metadata_json(study_id, study_dir)
+        entry = require_study(study_id)
+    return Response(content=study_json_bytes(entry), media_type="application/json")
\ No newline at end of file
@@ -0,0 +1,136 @@
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus text exposition without the client library; each process
+# (backend, proxy) keeps its own registry and serves it on /metrics.
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_METRIC = "dicom_stage_duration_seconds"
+
+stage_histograms = {}
+counters = {}
+# executor name -> futures from submit_tracked not yet finished
+executor_futures = {}
+metrics_lock = threading.Lock()
+# Per-request (stage, seconds) list, set by the timing-header middleware
+request_stages = contextvars.ContextVar("request_stages", default=None)
+
+def observe_stage(stage, seconds):
+    with metrics_lock:
+        hist = stage_histograms.get(stage)
+        if hist is None:
+            hist = stage_histograms[stage] = {"buckets": [0] * len(STAGE_BUCKETS), "sum": 0.0, "count": 0}
+        idx = bisect.bisect_left(STAGE_BUCKETS, seconds)
+        if idx < len(STAGE_BUCKETS):
+            hist["buckets"][idx] += 1
+        hist["sum"] += seconds
+        hist["count"] += 1
+    stages = request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+@contextmanager
+def stage_timer(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def timed(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_iter(stage, iterable):
+    # For streamed bodies: time from first pull to exhaustion (or disconnect)
+    start = time.perf_counter()
+    try:
+        yield from iterable
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def inc_counter(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with metrics_lock:
+        counters[key] = counters.get(key, 0) + value
+
+def submit_tracked(executor_name, executor, fn, *args):
+    """
+    executor.submit(fn, *args), counted per executor name until the future
+    finishes; executor_load reports the counts without executor internals.
+    """
+    future = executor.submit(fn, *args)
+    inc_counter("dicom_executor_tasks_submitted_total", executor=executor_name)
+    with metrics_lock:
+        executor_futures.setdefault(executor_name, set()).add(future)
+
+    def finished(f):
+        with metrics_lock:
+            executor_futures[executor_name].discard(f)
+        inc_counter("dicom_executor_tasks_completed_total", executor=executor_name)
+
+    future.add_done_callback(finished)
+    return future
+
+def executor_load(executor_name):
+    # (queued, running) for futures from submit_tracked. A process pool marks
+    # a future running once it is handed to its call queue, which may be one
+    # item ahead of the workers.
+    with metrics_lock:
+        futures = list(executor_futures.get(executor_name, ()))
+    running = sum(1 for f in futures if f.running())
+    return len(futures) - running, running
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+def render_metrics(families=()):
+    """
+    Exposition text for all stage histograms and counters, plus the given
+    (name, type, help, [(labels_dict, value), ...]) families sampled by the caller.
+    """
+    lines = [
+        f"# HELP {STAGE_METRIC} Time spent per processing stage.",
+        f"# TYPE {STAGE_METRIC} histogram",
+    ]
+    with metrics_lock:
+        for stage, hist in sorted(stage_histograms.items()):
+            cumulative = 0
+            for bound, n in zip(STAGE_BUCKETS, hist["buckets"]):
+                cumulative += n
+                lines.append(f'{STAGE_METRIC}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{STAGE_METRIC}_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+            lines.append(f'{STAGE_METRIC}_sum{{stage="{stage}"}} {hist["sum"]:.6f}')
+            lines.append(f'{STAGE_METRIC}_count{{stage="{stage}"}} {hist["count"]}')
+        counter_items = sorted(counters.items())
+    seen = set()
+    for (name, labels), value in counter_items:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
+
+def server_timing(stages, total):
+    # Repeated stages (e.g. one decode per slice) are summed
+    totals = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    parts = [f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
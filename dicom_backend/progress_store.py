@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+FINISHED_TTL = 300       # keep done/error tasks around long enough to be read
+STALE_TTL = 3600         # drop tasks that stopped reporting without finishing
+MAX_TASKS = 10000
+SWEEP_INTERVAL = 30
+
+def is_finished(entry):
+    status = entry.get("status", "")
+    return status == "done" or status.startswith("error")
+
+def is_expired(entry, now):
+    age = now - entry["updated"]
+    return age > (FINISHED_TTL if is_finished(entry) else STALE_TTL)
+
+class MemoryProgressStore:
+    """
+    Per-process task progress, bounded and TTL-evicted.
+    """
+    def __init__(self, max_tasks=MAX_TASKS):
+        self.max_tasks = max_tasks
+        self.tasks = OrderedDict()
+        self.lock = threading.Lock()
+
+    def set(self, task_id, entry):
+        entry = {**entry, "updated": time.time()}
+        with self.lock:
+            self.tasks.pop(task_id, None)
+            self.tasks[task_id] = entry
+            self._evict(entry["updated"])
+
+    def get(self, task_id):
+        with self.lock:
+            entry = self.tasks.get(task_id)
+            if entry and is_expired(entry, time.time()):
+                del self.tasks[task_id]
+                return None
+            return entry
+
+    def remove(self, task_id):
+        with self.lock:
+            self.tasks.pop(task_id, None)
+
+    def _evict(self, now):
+        # Oldest-updated first; the dict is kept in update order
+        while self.tasks:
+            task_id, entry = next(iter(self.tasks.items()))
+            if len(self.tasks) <= self.max_tasks and not is_expired(entry, now):
+                break
+            del self.tasks[task_id]
+
+class SqliteProgressStore:
+    """
+    Task progress in a SQLite file, shared by every worker pointing at it.
+    """
+    def __init__(self, path, max_tasks=MAX_TASKS):
+        self.path = path
+        self.max_tasks = max_tasks
+        self.last_sweep = 0
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS progress ("
+                " task_id TEXT PRIMARY KEY, data TEXT NOT NULL,"
+                " finished INTEGER NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS progress_updated ON progress (updated)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def set(self, task_id, entry):
+        entry = {**entry, "updated": time.time()}
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO progress (task_id, data, finished, updated) VALUES (?, ?, ?, ?)",
+                (task_id, json.dumps(entry), int(is_finished(entry)), entry["updated"]),
+            )
+            if entry["updated"] - self.last_sweep > SWEEP_INTERVAL:
+                self.last_sweep = entry["updated"]
+                self._evict(conn, entry["updated"])
+        finally:
+            conn.close()
+
+    def get(self, task_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT data FROM progress WHERE task_id = ?", (task_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        entry = json.loads(row[0])
+        return None if is_expired(entry, time.time()) else entry
+
+    def remove(self, task_id):
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM progress WHERE task_id = ?", (task_id,))
+        finally:
+            conn.close()
+
+    def _evict(self, conn, now):
+        conn.execute(
+            "DELETE FROM progress WHERE (finished AND updated < ?) OR updated < ?",
+            (now - FINISHED_TTL, now - STALE_TTL),
+        )
+        conn.execute(
+            "DELETE FROM progress WHERE task_id IN ("
+            " SELECT task_id FROM progress ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+            (self.max_tasks,),
+        )
+
+def make_progress_store(path=None):
+    return SqliteProgressStore(path) if path else MemoryProgressStore()
@@ -0,0 +1,197 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+# Rendered images shared by every worker process through the filesystem.
+# Each entry is one file named by the hash of its render key; writes go to a
+# temp file and are renamed into place, so readers never see partial data.
+TOUCH_INTERVAL = 60      # seconds between mtime bumps of a hot entry
+SWEEP_INTERVAL = 30      # seconds between eviction sweeps per process
+SWEEP_LOW_WATER = 0.9    # sweeps evict down to this fraction of the budget
+ENTRY_SUFFIX = ".jpg"
+
+class DiskRenderCache:
+    """
+    Content-addressed render cache in a directory shared by all workers.
+    Eviction is global: whichever process wins the sweep lock scans the
+    whole directory and removes least-recently-used entries (by mtime)
+    until the total is back under budget.
+    """
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.written = 0
+        self.last_sweep = 0.0
+        self.sweeping = False
+        self.entries = 0
+        self.bytes = 0
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, name, key):
+        # Keys start with "<study_id>:"; entries live under their study so a
+        # deleted study can be dropped in one go
+        digest = hashlib.sha256(f"{name}:{key}".encode()).hexdigest()
+        study = key.split(":", 1)[0]
+        if not study.isalnum():
+            study = "_"
+        return os.path.join(self.root, study, digest[:2], digest + ENTRY_SUFFIX)
+
+    def get(self, name, key):
+        path = self.path(name, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+        except OSError:
+            return None
+        if time.time() - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return data
+
+    def set(self, name, key, data):
+        if len(data) > self.max_bytes:
+            return
+        path = self.path(name, key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self.lock:
+            self.written += len(data)
+            due = self.written > self.max_bytes * (1 - SWEEP_LOW_WATER) or time.time() - self.last_sweep > SWEEP_INTERVAL
+        if due:
+            self.sweep_async()
+
+    def sweep_async(self):
+        # A sweep walks and stats the whole directory; run it off the request path
+        with self.lock:
+            if self.sweeping:
+                return
+            self.sweeping = True
+        threading.Thread(target=self._background_sweep, name="render-cache-sweep", daemon=True).start()
+
+    def _background_sweep(self):
+        try:
+            self.sweep()
+        finally:
+            with self.lock:
+                self.sweeping = False
+
+    def stats(self):
+        # entries/bytes as of the last sweep
+        return {"entries": self.entries, "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+    def evict_study(self, study_id):
+        shutil.rmtree(os.path.join(self.root, str(study_id)), ignore_errors=True)
+
+    def sweep(self, force=False):
+        """
+        Scan the shared directory and evict oldest entries over budget. Only
+        one process sweeps at a time; the others skip rather than wait.
+        """
+        with self.lock:
+            if not force and time.time() - self.last_sweep < 1:
+                return
+            self.last_sweep = time.time()
+            self.written = 0
+        with open(os.path.join(self.root, ".sweep.lock"), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return
+            try:
+                entries = []
+                now = time.time()
+                for dirpath, _, filenames in os.walk(self.root):
+                    for name in filenames:
+                        path = os.path.join(dirpath, name)
+                        try:
+                            st = os.stat(path)
+                        except OSError:
+                            continue
+                        if name.endswith(".tmp"):
+                            # Left behind by a worker that died mid-write
+                            if now - st.st_mtime > 3600:
+                                self._remove(path)
+                            continue
+                        if name.endswith(ENTRY_SUFFIX):
+                            entries.append((st.st_mtime, st.st_size, path))
+                total = sum(size for _, size, _ in entries)
+                if total > self.max_bytes:
+                    entries.sort()
+                    target = self.max_bytes * SWEEP_LOW_WATER
+                    kept = len(entries)
+                    for _, size, path in entries:
+                        if total <= target:
+                            break
+                        if self._remove(path):
+                            total -= size
+                            kept -= 1
+                    self.entries = kept
+                else:
+                    self.entries = len(entries)
+                self.bytes = total
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+class TieredRenderCache:
+    """
+    Lookup through tiers in order (e.g. /dev/shm then disk), promoting hits
+    into the faster tiers; stores go to every tier.
+    """
+    def __init__(self, tiers):
+        self.tiers = tiers
+
+    def get(self, name, key):
+        for i, tier in enumerate(self.tiers):
+            data = tier.get(name, key)
+            if data is not None:
+                for faster in self.tiers[:i]:
+                    faster.set(name, key, data)
+                return data
+        return None
+
+    def set(self, name, key, data):
+        for tier in self.tiers:
+            tier.set(name, key, data)
+
+    def stats(self):
+        # The backing (last) tier holds every entry
+        return self.tiers[-1].stats()
+
+    def evict_study(self, study_id):
+        for tier in self.tiers:
+            tier.evict_study(study_id)
+
+def make_render_cache(disk_dir=None, disk_bytes=0, shm_dir=None, shm_bytes=0):
+    tiers = []
+    if shm_dir and shm_bytes:
+        tiers.append(DiskRenderCache(shm_dir, shm_bytes))
+    if disk_dir and disk_bytes:
+        tiers.append(DiskRenderCache(disk_dir, disk_bytes))
+    if not tiers:
+        return None
+    return tiers[0] if len(tiers) == 1 else TieredRenderCache(tiers)
@@ -0,0 +1,112 @@
+import glob
+import json
+import mmap
+import os
+import time
+import numpy as np
+
+# One data file per series holding every rendered slice (and optionally the
+# rescaled int16 pixels) back to back, plus a JSON index of name -> offset.
+# Replaces thousands of small files with one, read through mmap.
+PACK_VERSION = 1
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".pack.json"
+ALIGN = 16
+
+def index_path(base):
+    return base + INDEX_SUFFIX
+
+def write_pack(base, items):
+    """
+    Write (name, data) pairs, where data is bytes or an int16 array, into a
+    new pack and switch the index to it. Each pack generation gets its own
+    data file, so a reader never pairs an index with the wrong data.
+    """
+    data_path = f"{base}.{time.time_ns()}{PACK_SUFFIX}"
+    entries = {}
+    offset = 0
+    with open(data_path + ".tmp", "wb") as f:
+        for name, data in items:
+            if offset % ALIGN:
+                pad = ALIGN - offset % ALIGN
+                f.write(b"\0" * pad)
+                offset += pad
+            if isinstance(data, np.ndarray):
+                arr = np.ascontiguousarray(data, dtype="<i2")
+                f.write(arr.tobytes())
+                entries[name] = [offset, arr.nbytes, list(arr.shape)]
+                offset += arr.nbytes
+            else:
+                f.write(data)
+                entries[name] = [offset, len(data)]
+                offset += len(data)
+    os.replace(data_path + ".tmp", data_path)
+    path = index_path(base)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"version": PACK_VERSION, "data": os.path.basename(data_path), "size": offset, "entries": entries}, f)
+    os.replace(path + ".tmp", path)
+    # Readers that already mapped an older generation keep it until they drop it
+    for old in glob.glob(glob.escape(base) + ".*" + PACK_SUFFIX):
+        if old != data_path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+    return entries
+
+class SeriesPack:
+    """
+    Read-only view of a pack. get() returns zero-copy memoryviews into the
+    mapping, so the pack stays mapped while any of them is alive.
+    """
+    def __init__(self, base):
+        with open(index_path(base), "r") as f:
+            index = json.load(f)
+        if index.get("version") != PACK_VERSION:
+            raise ValueError(f"unsupported pack version {index.get('version')}")
+        self.entries = index["entries"]
+        self.path = os.path.join(os.path.dirname(base), index["data"])
+        with open(self.path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.mtime = st.st_mtime
+            size = st.st_size
+            if size < index["size"]:
+                raise ValueError(f"{self.path} is truncated")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.view = memoryview(self.mm) if self.mm is not None else memoryview(b"")
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        offset, length = entry[0], entry[1]
+        return self.view[offset:offset + length]
+
+    def pixels(self, name):
+        entry = self.entries.get(name)
+        if entry is None or len(entry) < 3:
+            return None
+        offset, length, shape = entry
+        return np.frombuffer(self.view[offset:offset + length], dtype="<i2").reshape(shape)
+
+def stale_pack_files(pack_dir):
+    """
+    Data files no index points at, left when a repack was interrupted
+    before it removed the previous generation.
+    """
+    try:
+        names = os.listdir(pack_dir)
+    except OSError:
+        return []
+    live = set()
+    for name in names:
+        if name.endswith(INDEX_SUFFIX):
+            try:
+                with open(os.path.join(pack_dir, name), "r") as f:
+                    live.add(json.load(f)["data"])
+            except (OSError, ValueError, KeyError):
+                continue
+    return [os.path.join(pack_dir, n) for n in names if n.endswith(PACK_SUFFIX) and n not in live]
@@ -0,0 +1,148 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.encaps import encapsulate
+from pydicom.sequence import Sequence
+from pydicom.uid import (
+    ExplicitVRLittleEndian, JPEGBaseline8Bit, JPEG2000Lossless, RLELossless,
+    PYDICOM_IMPLEMENTATION_UID, generate_uid,
+)
+
+CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2"
+ENHANCED_CT_IMAGE_STORAGE = "1.2.840.10008.5.1.4.1.1.2.1"
+TRANSFER_SYNTAXES = {
+    "uncompressed": ExplicitVRLittleEndian,
+    "jpeg": JPEGBaseline8Bit,
+    "jpeg2000": JPEG2000Lossless,
+    "rle": RLELossless,
+}
+
+def phantom_volume(slices, rows, cols, bits=16, seed=0):
+    """
+    Deterministic CT-like phantom: body ellipse, organs and bone ring, plus noise.
+    Returns stored values (int16 with intercept -1024, or uint8 for bits=8).
+    """
+    rng = np.random.default_rng(seed)
+    z = np.linspace(-1, 1, slices)[:, None, None]
+    y = np.linspace(-1, 1, rows)[None, :, None]
+    x = np.linspace(-1, 1, cols)[None, None, :]
+    hu = np.full((slices, rows, cols), -1000.0, dtype=np.float32)
+    body = (x / 0.85) ** 2 + (y / 0.7) ** 2 <= 1 - 0.3 * z ** 2
+    hu[body] = 40
+    hu[body & (((x - 0.3) / 0.25) ** 2 + (y / 0.3) ** 2 + (z / 0.8) ** 2 <= 1)] = 60
+    hu[body & (((x + 0.35) / 0.2) ** 2 + ((y + 0.1) / 0.25) ** 2 <= 1)] = -800
+    ring = (x / 0.2) ** 2 + ((y - 0.45) / 0.15) ** 2
+    hu[body & (ring <= 1) & (ring >= 0.5)] = 900
+    hu += rng.normal(0, 12, hu.shape).astype(np.float32)
+    if bits == 8:
+        return np.clip((hu + 160) * (255 / 400), 0, 255).astype(np.uint8)
+    stored = np.clip(hu + 1024, 0, (1 << (bits - 1)) - 1)
+    return stored.astype(np.int16)
+
+def _base_dataset(sop_class, ts, study_uid, series_uid, rows, cols, bits, description):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = sop_class
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ts
+    meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.PatientName = "SYNTHETIC^PHANTOM"
+    ds.PatientID = "SYNTH0001"
+    ds.StudyDate = "20250101"
+    ds.StudyDescription = "Synthetic benchmark study"
+    ds.SeriesDescription = description
+    ds.Modality = "CT"
+    ds.SeriesNumber = 1
+    ds.Rows = rows
+    ds.Columns = cols
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 8 if bits == 8 else 16
+    ds.BitsStored = bits
+    ds.HighBit = bits - 1
+    ds.PixelRepresentation = 0 if bits == 8 else 1
+    ds.PixelSpacing = [0.7, 0.7]
+    ds.SliceThickness = 1.0
+    ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+    if bits == 8:
+        ds.WindowCenter, ds.WindowWidth = 128, 256
+    else:
+        ds.RescaleIntercept, ds.RescaleSlope = -1024, 1
+        ds.WindowCenter, ds.WindowWidth = 40, 400
+    return ds
+
+def _encode_pixels(ds, frames, ts):
+    if ts == ExplicitVRLittleEndian:
+        ds.PixelData = np.ascontiguousarray(frames).tobytes()
+    elif ts == JPEGBaseline8Bit:
+        if frames.dtype != np.uint8:
+            raise ValueError("JPEG baseline needs bits=8")
+        encoded = []
+        for frame in frames:
+            buf = io.BytesIO()
+            Image.fromarray(frame).save(buf, format="JPEG", quality=90)
+            encoded.append(buf.getvalue())
+        ds.PixelData = encapsulate(encoded)
+        ds["PixelData"].VR = "OB"
+        ds.file_meta.TransferSyntaxUID = ts
+        ds.LossyImageCompression = "01"
+    else:
+        ds.compress(ts, frames if len(frames) > 1 else frames[0])
+
+def write_synthetic_study(
+    out_dir, slices=64, rows=512, cols=512, bits=16, transfer_syntax="uncompressed",
+    multiframe=False, seed=0,
+):
+    """
+    Write a synthetic CT series to out_dir; returns the list of file paths.
+    Multi-frame writes one Enhanced CT object with per-frame positions.
+    """
+    ts = TRANSFER_SYNTAXES[transfer_syntax]
+    os.makedirs(out_dir, exist_ok=True)
+    volume = phantom_volume(slices, rows, cols, bits, seed)
+    study_uid, series_uid = generate_uid(), generate_uid()
+    description = f"Synthetic {transfer_syntax} {bits}-bit {'multi-frame' if multiframe else 'single-frame'}"
+    paths = []
+    if multiframe:
+        ds = _base_dataset(ENHANCED_CT_IMAGE_STORAGE, ts, study_uid, series_uid, rows, cols, bits, description)
+        ds.InstanceNumber = 1
+        ds.NumberOfFrames = slices
+        shared = Dataset()
+        orientation = Dataset()
+        orientation.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        measures = Dataset()
+        measures.PixelSpacing = [0.7, 0.7]
+        measures.SliceThickness = 1.0
+        shared.PlaneOrientationSequence = Sequence([orientation])
+        shared.PixelMeasuresSequence = Sequence([measures])
+        ds.SharedFunctionalGroupsSequence = Sequence([shared])
+        per_frame = []
+        for i in range(slices):
+            position = Dataset()
+            position.ImagePositionPatient = [0, 0, float(i)]
+            group = Dataset()
+            group.PlanePositionSequence = Sequence([position])
+            per_frame.append(group)
+        ds.PerFrameFunctionalGroupsSequence = Sequence(per_frame)
+        _encode_pixels(ds, volume, ts)
+        path = os.path.join(out_dir, "multiframe.dcm")
+        ds.save_as(path, enforce_file_format=True)
+        return [path]
+    for i in range(slices):
+        ds = _base_dataset(CT_IMAGE_STORAGE, ts, study_uid, series_uid, rows, cols, bits, description)
+        ds.InstanceNumber = i + 1
+        ds.ImagePositionPatient = [0, 0, float(i)]
+        ds.SliceLocation = float(i)
+        _encode_pixels(ds, volume[i:i + 1], ts)
+        path = os.path.join(out_dir, f"IM{i + 1:05d}.dcm")
+        ds.save_as(path, enforce_file_format=True)
+        paths.append(path)
+    return paths
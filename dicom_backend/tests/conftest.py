@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The backend is a flat set of modules run from dicom_backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def backend(tmp_path_factory):
+    """
+    main imported against a scratch catalog, render cache and ./uploads
+    (UPLOAD_ROOT is relative to the working directory).
+    """
+    root = tmp_path_factory.mktemp("backend")
+    cwd = os.getcwd()
+    os.environ.update({
+        "DICOM_CATALOG": str(root / "catalog.sqlite3"),
+        "DICOM_RENDER_CACHE": str(root / "render_cache"),
+        "DICOM_INGEST_PROCESSES": "0",
+    })
+    os.chdir(root)
+    try:
+        import main
+        yield main
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,51 @@
+import fcntl
+import os
+import time
+import zipfile
+
+from synth_dicom import write_synthetic_study
+
+def interrupted_zip_upload(backend, tmp_path):
+    # What a worker leaves behind when it stops before extracting an upload
+    paths = write_synthetic_study(str(tmp_path / "src"), slices=3, rows=64, cols=64)
+    study_id = backend.allocate_study_id()
+    zip_path = os.path.join(backend.get_study_dir(study_id), "upload.zip")
+    with zipfile.ZipFile(zip_path, "w") as zf:
+        for path in paths:
+            zf.write(path, os.path.basename(path))
+    backend.write_metadata_json(study_id, {"study_id": study_id, "series": [], "status": "queued"})
+    return study_id, zip_path
+
+def wait_for_ingest(backend, study_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while backend.ingest_active(study_id) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+def test_interrupted_ingest_is_requeued(backend, tmp_path):
+    study_id, zip_path = interrupted_zip_upload(backend, tmp_path)
+    assert study_id in backend.recover_interrupted_ingests()
+    wait_for_ingest(backend, study_id)
+    assert backend.ingest_jobs[study_id]["state"] == "ready"
+    assert backend.load_metadata_json(study_id)["status"] == "ready"
+    assert not os.path.exists(zip_path)
+    assert backend.select_mpr_series(study_id)
+
+def test_ingest_owned_elsewhere_is_left_alone(backend, tmp_path):
+    study_id, zip_path = interrupted_zip_upload(backend, tmp_path)
+    lock_path = os.path.join(backend.get_study_dir(study_id), backend.INGEST_LOCK_FILENAME)
+    with open(lock_path, "a") as other_worker:
+        fcntl.flock(other_worker, fcntl.LOCK_EX)
+        assert study_id not in backend.recover_interrupted_ingests()
+    assert os.path.exists(zip_path)
+    assert study_id not in backend.ingest_jobs
+
+def test_finished_jobs_are_pruned(backend, monkeypatch):
+    monkeypatch.setattr(backend, "INGEST_JOB_TTL", 0)
+    backend.set_ingest_state("old-job", "ready")
+    backend.ingest_jobs["old-job"]["updated"] -= 1
+    study_id = backend.allocate_study_id()
+    backend.reserve_ingest(study_id)
+    backend.release_ingest_lock(study_id)
+    assert "old-job" not in backend.ingest_jobs
+    assert backend.ingest_jobs[study_id]["state"] == "queued"
+    del backend.ingest_jobs[study_id]
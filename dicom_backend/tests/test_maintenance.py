@@ -0,0 +1,71 @@
+import io
+import os
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+from synth_dicom import write_synthetic_study
+
+SLICES = 4
+
+@pytest.fixture
+def study(backend):
+    study_id = backend.allocate_study_id()
+    study_dir = backend.get_study_dir(study_id)
+    write_synthetic_study(study_dir, slices=SLICES, rows=64, cols=64)
+    meta_json = backend.build_metadata_json(study_id, study_dir)
+    return study_id, meta_json["series"][0]
+
+def evict_everything(backend, monkeypatch, study_id):
+    monkeypatch.setattr(backend, "DISK_BUDGET_BYTES", 1)
+    monkeypatch.setattr(backend, "EVICT_MIN_IDLE", 0)
+    report = TestClient(backend.app).post("/maintenance/run").json()
+    assert report["evicted"]
+    assert backend.dir_size(backend.get_jpeg_dir(study_id)) == 0
+    assert backend.dir_size(backend.get_pack_dir(study_id)) == 0
+    backend.evict_study_caches(study_id)
+
+@pytest.mark.parametrize("pack", [False, True])
+def test_jpeg_export_after_eviction(backend, study, monkeypatch, pack):
+    study_id, series = study
+    if pack:
+        backend.pack_series(study_id, series)
+    evict_everything(backend, monkeypatch, study_id)
+    client = TestClient(backend.app)
+    for url in (f"/studies/{study_id}/series/{series['series_id']}/export/file", f"/studies/{study_id}/export/file"):
+        resp = client.get(url, params={"format": "jpeg"})
+        assert resp.status_code == 200
+        assert len(resp.content) == int(resp.headers["content-length"])
+        with zipfile.ZipFile(io.BytesIO(resp.content)) as zf:
+            assert zf.testzip() is None
+            assert len(zf.namelist()) == SLICES
+
+def test_cine_export_after_eviction(backend, study, monkeypatch, tmp_path):
+    imageio_ffmpeg = pytest.importorskip("imageio_ffmpeg")
+    study_id, series = study
+    evict_everything(backend, monkeypatch, study_id)
+    resp = TestClient(backend.app).get(
+        f"/studies/{study_id}/series/{series['series_id']}/export/file", params={"format": "mp4", "fps": 4},
+    )
+    assert resp.status_code == 200
+    path = tmp_path / "cine.mp4"
+    path.write_bytes(resp.content)
+    frames, _ = imageio_ffmpeg.count_frames_and_secs(str(path))
+    assert frames == SLICES
+
+def test_temp_sweep_spares_source_files(backend, study, monkeypatch):
+    study_id, _ = study
+    study_dir = backend.get_study_dir(study_id)
+    source = os.path.join(study_dir, "IM0001.tmp")
+    derived = os.path.join(backend.get_jpeg_dir(study_id), "x.jpg.1.2.tmp")
+    metadata_tmp = backend.get_metadata_path(study_id) + ".tmp"
+    for path in (source, derived, metadata_tmp):
+        with open(path, "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(path, (0, 0))
+    monkeypatch.setattr(backend, "DISK_BUDGET_BYTES", 0)
+    report = TestClient(backend.app).post("/maintenance/run").json()
+    assert report["temp_files_removed"] >= 2
+    assert os.path.exists(source)
+    assert not os.path.exists(derived) and not os.path.exists(metadata_tmp)
@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pydicom
+import pytest
+from fastapi.testclient import TestClient
+
+from synth_dicom import write_synthetic_study
+
+@pytest.fixture
+def target(backend, tmp_path):
+    paths = write_synthetic_study(str(tmp_path / "src"), slices=4, rows=64, cols=64)
+    study_id = backend.allocate_study_id()
+    study_dir = backend.get_study_dir(study_id)
+    os.makedirs(study_dir, exist_ok=True)
+    for path in paths:
+        shutil.copy(path, study_dir)
+    backend.build_metadata_json(study_id, study_dir)
+    return study_id, paths
+
+def upload(backend, paths):
+    upload_id = backend.allocate_study_id()
+    os.makedirs(backend.get_study_dir(upload_id), exist_ok=True)
+    for path in paths:
+        shutil.copy(path, backend.get_study_dir(upload_id))
+    backend.run_ingest(upload_id)
+    return upload_id, backend.ingest_jobs[upload_id]
+
+def changed_copy(path, out):
+    ds = pydicom.dcmread(path)
+    arr = ds.pixel_array
+    arr[:] = 0
+    ds.PixelData = arr.tobytes()
+    ds.save_as(out)
+    return str(out), ds.SOPInstanceUID
+
+def test_replaced_instance_gets_new_revision(backend, target, tmp_path):
+    study_id, paths = target
+    client = TestClient(backend.app)
+    series_id = backend.load_metadata_json(study_id)["series"][0]["series_id"]
+    path, sop_uid = changed_copy(paths[1], tmp_path / "changed.dcm")
+    url = f"/studies/{study_id}/series/{series_id}/image/{sop_uid}"
+    before = client.get(url, params={"rev": 0})
+    assert before.headers["cache-control"].startswith("public")
+
+    upload_id, job = upload(backend, [path, paths[2]])
+    assert job["state"] == "merged" and job["merged_into"] == study_id
+    assert (job["replaced"], job["duplicates"]) == (1, 1)
+    assert not os.path.exists(backend.get_study_dir(upload_id))
+
+    image = backend.find_image(backend.require_study(study_id), series_id, sop_uid)
+    assert image["revision"] == 1
+    after = client.get(url, params={"rev": 1})
+    assert after.content != before.content
+    assert after.headers["cache-control"].startswith("public")
+    # A URL naming an old revision must revalidate
+    assert client.get(url, params={"rev": 0}).headers["cache-control"] == "no-cache"
+
+def test_failed_merge_is_rolled_back(backend, target, tmp_path, monkeypatch):
+    study_id, paths = target
+    meta_before = backend.load_metadata_json(study_id)
+    path, _ = changed_copy(paths[1], tmp_path / "changed.dcm")
+    late = write_synthetic_study(str(tmp_path / "late"), slices=2, rows=64, cols=64)
+    for p in late:
+        ds = pydicom.dcmread(p)
+        ds.StudyInstanceUID = pydicom.dcmread(paths[0]).StudyInstanceUID
+        ds.save_as(p)
+    convert = backend.extract_and_convert
+
+    def failing_convert(*args, **kwargs):
+        convert(*args, **kwargs)
+        raise RuntimeError("conversion failed")
+
+    monkeypatch.setattr(backend, "extract_and_convert", failing_convert)
+    upload_id, job = upload(backend, [path] + late)
+    assert job["state"] == "failed"
+    assert backend.ingest_jobs[study_id]["state"] == "ready"
+    assert backend.load_metadata_json(study_id) == meta_before
+    stored = os.path.join(backend.get_study_dir(study_id), meta_before["series"][0]["images"][1]["filename"])
+    with open(stored, "rb") as f, open(paths[1], "rb") as g:
+        assert f.read() == g.read()
+    assert not os.path.exists(os.path.join(backend.get_study_dir(study_id), f"upload_{upload_id}"))
+    assert len(os.listdir(backend.get_study_dir(upload_id))) == 1 + len(late) + 1  # files + metadata.json
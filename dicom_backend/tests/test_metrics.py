@@ -0,0 +1,21 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.testclient import TestClient
+
+from metrics import executor_load, submit_tracked
+
+def test_executor_load_counts_queued_and_running():
+    release = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = [submit_tracked("test_pool", executor, release.wait) for _ in range(3)]
+        while not futures[0].running():
+            pass
+        assert executor_load("test_pool") == (2, 1)
+        release.set()
+    assert executor_load("test_pool") == (0, 0)
+
+def test_metrics_report_executor_gauges(backend):
+    text = TestClient(backend.app).get("/metrics").text
+    assert 'dicom_executor_queue_depth{executor="ingest_pool"} 0' in text
+    assert 'dicom_executor_max_workers{executor="ingest_pool"}' in text
@@ -0,0 +1,26 @@
+import os
+
+from fastapi.testclient import TestClient
+
+from synth_dicom import write_synthetic_study
+
+def test_failed_render_leaves_no_empty_jpeg(backend):
+    study_id = backend.allocate_study_id()
+    study_dir = backend.get_study_dir(study_id)
+    write_synthetic_study(study_dir, slices=3, rows=64, cols=64)
+    series = backend.build_metadata_json(study_id, study_dir)["series"][0]
+    image = series["images"][1]
+    jpeg_path = os.path.join(backend.get_jpeg_dir(study_id), image["jpeg_filename"])
+    os.remove(jpeg_path)
+    backend.evict_study_caches(study_id)
+    dcm_path = os.path.join(study_dir, image["filename"])
+    with open(dcm_path, "rb") as f:
+        data = f.read()
+    with open(dcm_path, "wb") as f:
+        f.write(data[:len(data) // 2])
+
+    client = TestClient(backend.app, raise_server_exceptions=False)
+    url = f"/studies/{study_id}/series/{series['series_id']}/image/{image['image_id']}"
+    for _ in range(2):
+        assert client.get(url, params={"rev": 0}).status_code == 500
+    assert not os.path.exists(jpeg_path)
@@ -0,0 +1,56 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+import zip_stream
+from zip_stream import iter_byte_range, iter_stored_zip, plan_stored_zip, stored_zip_size
+
+def write_files(tmp_path):
+    files = []
+    for i, size in enumerate([0, 1, 1000, 3 * 1024 + 7]):
+        path = tmp_path / f"f{i}.bin"
+        path.write_bytes(os.urandom(size))
+        files.append((f"dir/ünï{i}.bin", str(path)))
+    # In-memory views, the way packed series are exported from their mmap
+    packed = memoryview(os.urandom(5000))
+    files.append(("packed/a.jpg", packed[100:2100], 1700000000.0))
+    files.append(("packed/b.jpg", packed[2100:], 1700000000.0))
+    files.append(("missing.bin", str(tmp_path / "missing.bin")))
+    return files
+
+def expected_contents(files):
+    contents = {}
+    for arcname, source, *_ in files:
+        if not isinstance(source, str):
+            contents[arcname] = bytes(source)
+        elif os.path.exists(source):
+            with open(source, "rb") as f:
+                contents[arcname] = f.read()
+    return contents
+
+def check_archive(files, chunk_size=zip_stream.CHUNK_SIZE):
+    entries = plan_stored_zip(files)
+    data = b"".join(iter_stored_zip(entries, chunk_size=chunk_size))
+    # Content-Length is computed up front and must match the stream exactly
+    assert len(data) == stored_zip_size(entries)
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert {name: zf.read(name) for name in zf.namelist()} == expected_contents(files)
+    return entries, data
+
+def test_round_trip(tmp_path):
+    check_archive(write_files(tmp_path), chunk_size=512)
+
+def test_round_trip_zip64(tmp_path, monkeypatch):
+    monkeypatch.setattr(zip_stream, "ZIP64_LIMIT", 64)
+    _, data = check_archive(write_files(tmp_path))
+    assert b"PK\x06\x06" in data and b"PK\x06\x07" in data
+
+@pytest.mark.parametrize("start, end", [(0, 0), (0, 99), (37, 4100), (5000, None)])
+def test_byte_range(tmp_path, start, end):
+    entries, data = check_archive(write_files(tmp_path))
+    end = len(data) - 1 if end is None else end
+    part = b"".join(iter_byte_range(iter_stored_zip(entries, chunk_size=256), start, end))
+    assert part == data[start:end + 1]
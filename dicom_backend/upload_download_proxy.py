@@ -1,18 +1,33 @@
+import asyncio
+import json
 import os
-import shutil
-import tempfile
-import threading
 import time
-from fastapi import FastAPI, UploadFile, File, HTTPException, Response, Request
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Response, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
-import requests
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+import httpx
 from uuid import uuid4
-from concurrent.futures import ThreadPoolExecutor
+from progress_store import make_progress_store, is_finished
+from metrics import stage_timer, observe_stage, inc_counter, render_metrics
 
 # === CONFIG ===
-MAIN_BACKEND_URL = "http://127.0.0.1:8000"  # Change if your main backend is elsewhere
+MAIN_BACKEND_URL = os.environ.get("MAIN_BACKEND_URL", "http://127.0.0.1:8000")  # Change if your main backend is elsewhere
+UPLOAD_CHUNK_SIZE = int(os.environ.get("PROXY_UPLOAD_CHUNK_MB", "1")) * 1024 * 1024
+BACKEND_TIMEOUT = float(os.environ.get("PROXY_BACKEND_TIMEOUT", "300"))
+BACKEND_MAX_CONNECTIONS = int(os.environ.get("PROXY_MAX_CONNECTIONS", "20"))
+DOWNLOAD_CHUNK_SIZE = int(os.environ.get("PROXY_DOWNLOAD_CHUNK_KB", "256")) * 1024
+RELAY_REQUEST_HEADERS = ("range", "if-range")
+RELAY_RESPONSE_HEADERS = (
+    "content-length", "content-range", "accept-ranges", "etag", "last-modified", "content-disposition",
+)
+
+# Set to a SQLite path when running several workers so they share progress
+PROGRESS_DB = os.environ.get("PROXY_PROGRESS_DB")
+PROGRESS_PUSH_INTERVAL = float(os.environ.get("PROXY_PROGRESS_PUSH_INTERVAL", "0.25"))
+PROGRESS_KEEPALIVE = 15
+PROGRESS_UNKNOWN_TIMEOUT = 60
 
 # === FastAPI app ===
 app = FastAPI()
@@ -22,160 +37,182 @@ app.add_middleware(
 )
 
 # === Progress tracking ===
-progress_data = {}
-progress_lock = threading.Lock()
-executor = ThreadPoolExecutor(max_workers=4)
+progress_store = make_progress_store(PROGRESS_DB)
+
+# One pooled keep-alive client for everything relayed to the main backend
+backend_client = httpx.AsyncClient(
+    base_url=MAIN_BACKEND_URL,
+    timeout=httpx.Timeout(BACKEND_TIMEOUT, connect=10.0),
+    limits=httpx.Limits(max_connections=BACKEND_MAX_CONNECTIONS, max_keepalive_connections=BACKEND_MAX_CONNECTIONS),
+)
 
-def set_progress(task_id, percent, status=""):
-    with progress_lock:
-        progress_data[task_id] = {"percent": percent, "status": status}
+def set_progress(task_id, percent, status="", bytes_sent=None):
+    entry = {"percent": percent, "status": status}
+    if bytes_sent is not None:
+        entry["bytes"] = bytes_sent
+    progress_store.set(task_id, entry)
+
+def public_progress(entry):
+    if entry is None:
+        return {"percent": 0, "status": "starting"}
+    return {k: v for k, v in entry.items() if k != "updated"}
 
 def get_progress(task_id):
-    with progress_lock:
-        return progress_data.get(task_id, {"percent": 0, "status": "starting"})
+    return public_progress(progress_store.get(task_id))
 
 def remove_progress(task_id):
-    with progress_lock:
-        if task_id in progress_data:
-            del progress_data[task_id]
+    progress_store.remove(task_id)
 
-def safe_rmtree(path):
-    try:
-        shutil.rmtree(path)
-    except Exception:
-        pass
+async def report_progress(task_id, percent, status="", bytes_sent=None):
+    # The SQLite store blocks (up to its busy timeout under contention), so
+    # async paths write it from the threadpool rather than the event loop
+    await run_in_threadpool(set_progress, task_id, percent, status, bytes_sent)
 
-def background_forward_upload(task_id, temp_dir, file_paths, endpoint):
-    try:
-        set_progress(task_id, 0.5, "uploading to backend")
-        files_payload = []
-        for fp in file_paths:
-            files_payload.append(('files', (os.path.basename(fp), open(fp, 'rb'))))
-        def do_post():
-            try:
-                resp = requests.post(f"{MAIN_BACKEND_URL}{endpoint}", files=files_payload)
-                return resp
-            finally:
-                for _, (_, f) in files_payload:
-                    f.close()
-        future = executor.submit(do_post)
-        prog = 0.5
-        while not future.done():
-            prog = min(prog + 0.03, 0.95)
-            set_progress(task_id, prog, "uploading to backend")
-            time.sleep(0.5)
-        resp = future.result()
-        if resp.status_code == 200:
-            set_progress(task_id, 1.0, "done")
-        else:
-            set_progress(task_id, 1.0, f"error:{resp.status_code}")
-    except Exception as e:
-        set_progress(task_id, 1.0, f"error:{e}")
-    finally:
-        safe_rmtree(temp_dir)
+async def iter_forward_chunks(request: Request, task_id, total):
+    # Re-chunk the incoming body so the backend sees large writes, and count
+    # what has actually been handed to the backend connection.
+    sent = 0
+    buf = bytearray()
+    async for chunk in request.stream():
+        buf += chunk
+        if len(buf) < UPLOAD_CHUNK_SIZE:
+            continue
+        yield bytes(buf)
+        sent += len(buf)
+        inc_counter("proxy_relayed_bytes_total", len(buf), direction="upload")
+        buf.clear()
+        await report_progress(task_id, min(sent / total, 0.99) if total else 0, "uploading to backend", sent)
+    if buf:
+        yield bytes(buf)
+        sent += len(buf)
+        inc_counter("proxy_relayed_bytes_total", len(buf), direction="upload")
+    await report_progress(task_id, 0.99 if total else 0, "processing", sent)
 
-def background_forward_zip(task_id, temp_dir, zip_path, endpoint, fieldname="file"):
+async def forward_upload(request: Request, endpoint, task_id):
+    task_id = task_id or str(uuid4())
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise HTTPException(400, "Expected multipart/form-data")
+    headers = {"Content-Type": content_type}
+    total = int(request.headers.get("content-length") or 0)
+    if total:
+        headers["Content-Length"] = str(total)
+    await report_progress(task_id, 0, "uploading to backend")
     try:
-        set_progress(task_id, 0.5, "uploading to backend")
-        def do_post():
-            with open(zip_path, "rb") as f:
-                files = {fieldname: (os.path.basename(zip_path), f)}
-                resp = requests.post(f"{MAIN_BACKEND_URL}{endpoint}", files=files)
-                return resp
-        future = executor.submit(do_post)
-        prog = 0.5
-        while not future.done():
-            prog = min(prog + 0.03, 0.95)
-            set_progress(task_id, prog, "uploading to backend")
-            time.sleep(0.5)
-        resp = future.result()
-        if resp.status_code == 200:
-            set_progress(task_id, 1.0, "done")
-        else:
-            set_progress(task_id, 1.0, f"error:{resp.status_code}")
+        with stage_timer("proxy_upload"):
+            resp = await backend_client.post(
+                endpoint, content=iter_forward_chunks(request, task_id, total), headers=headers,
+            )
     except Exception as e:
-        set_progress(task_id, 1.0, f"error:{e}")
-    finally:
-        safe_rmtree(temp_dir)
+        await report_progress(task_id, 1.0, f"error:{e}")
+        raise HTTPException(502, f"Proxy upload error: {e}")
+    if resp.status_code != 200:
+        await report_progress(task_id, 1.0, f"error:{resp.status_code}")
+        return Response(resp.content, status_code=resp.status_code, media_type=resp.headers.get("content-type"))
+    body = resp.json()
+    await report_progress(task_id, 1.0, "done")
+    return {**body, "task_id": task_id, "status": "done"}
 
 @app.post("/proxy/upload/")
-async def proxy_upload(files: List[UploadFile] = File(...)):
-    task_id = str(uuid4())
-    temp_dir = tempfile.mkdtemp()
-    file_paths = []
-    try:
-        total = len(files)
-        for idx, file in enumerate(files):
-            out_path = os.path.join(temp_dir, file.filename)
-            os.makedirs(os.path.dirname(out_path), exist_ok=True)
-            with open(out_path, "wb") as f:
-                while True:
-                    chunk = await file.read(8192)
-                    if not chunk:
-                        break
-                    f.write(chunk)
-            file_paths.append(out_path)
-            set_progress(task_id, (idx+1)/(total*2), "receiving files")
-        threading.Thread(
-            target=background_forward_upload,
-            args=(task_id, temp_dir, file_paths, "/upload/"),
-            daemon=True
-        ).start()
-        return {"task_id": task_id, "status": "started"}
-    except Exception as e:
-        safe_rmtree(temp_dir)
-        set_progress(task_id, 1.0, f"error:{e}")
-        raise HTTPException(500, f"Proxy upload error: {e}")
+async def proxy_upload(request: Request, task_id: str = None):
+    # Body is relayed as-is (field "files"); nothing is spooled to disk here
+    return await forward_upload(request, "/upload/", task_id)
 
 @app.post("/proxy/upload_zip/")
-async def proxy_upload_zip(file: UploadFile = File(...)):
-    task_id = str(uuid4())
-    temp_dir = tempfile.mkdtemp()
-    try:
-        zip_path = os.path.join(temp_dir, file.filename)
-        with open(zip_path, "wb") as f:
-            while True:
-                chunk = await file.read(8192)
-                if not chunk:
-                    break
-                f.write(chunk)
-        set_progress(task_id, 0.45, "zip received")
-        threading.Thread(
-            target=background_forward_zip,
-            args=(task_id, temp_dir, zip_path, "/upload_zip/"),
-            daemon=True
-        ).start()
-        return {"task_id": task_id, "status": "started"}
-    except Exception as e:
-        safe_rmtree(temp_dir)
-        set_progress(task_id, 1.0, f"error:{e}")
-        raise HTTPException(500, f"Proxy upload_zip error: {e}")
+async def proxy_upload_zip(request: Request, task_id: str = None):
+    # Body is relayed as-is (field "file")
+    return await forward_upload(request, "/upload_zip/", task_id)
+
+@app.on_event("shutdown")
+async def close_backend_client():
+    await backend_client.aclose()
 
 @app.get("/proxy/progress/{task_id}")
 def proxy_progress(task_id: str):
     return get_progress(task_id)
 
+async def iter_progress_events(request: Request, task_id):
+    # Reads go through the store, so a stream served by one worker follows
+    # an upload handled by another when PROXY_PROGRESS_DB is shared.
+    last = None
+    last_sent = started = time.monotonic()
+    while not await request.is_disconnected():
+        entry = await run_in_threadpool(progress_store.get, task_id)
+        now = time.monotonic()
+        if entry is None and now - started > PROGRESS_UNKNOWN_TIMEOUT:
+            yield f"event: error\ndata: {json.dumps({'percent': 0, 'status': 'error:unknown task'})}\n\n"
+            return
+        state = public_progress(entry)
+        if state != last:
+            last, last_sent = state, now
+            yield f"data: {json.dumps(state)}\n\n"
+            if entry and is_finished(entry):
+                return
+        elif now - last_sent > PROGRESS_KEEPALIVE:
+            last_sent = now
+            yield ": keep-alive\n\n"
+        await asyncio.sleep(PROGRESS_PUSH_INTERVAL)
+
+@app.get("/proxy/progress/{task_id}/events")
+async def proxy_progress_events(request: Request, task_id: str):
+    return StreamingResponse(
+        iter_progress_events(request, task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def iter_relay(resp):
+    start = time.perf_counter()
+    try:
+        async for chunk in resp.aiter_raw(DOWNLOAD_CHUNK_SIZE):
+            inc_counter("proxy_relayed_bytes_total", len(chunk), direction="download")
+            yield chunk
+    finally:
+        observe_stage("proxy_download_stream", time.perf_counter() - start)
+
+async def relay_download(request: Request, path):
+    # Non-blocking relay over the shared pool; each chunk is awaited onto the
+    # client socket before the next is read from the backend (backpressure).
+    headers = {h: request.headers[h] for h in RELAY_REQUEST_HEADERS if h in request.headers}
+    backend_req = backend_client.build_request("GET", path, params=request.query_params, headers=headers)
+    try:
+        with stage_timer("proxy_download_headers"):
+            resp = await backend_client.send(backend_req, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(502, f"Backend error: {e}")
+    if resp.status_code not in (200, 206, 416):
+        body = await resp.aread()
+        await resp.aclose()
+        raise HTTPException(resp.status_code, f"Backend error: {body.decode(errors='replace')}")
+    relay_headers = {h: resp.headers[h] for h in RELAY_RESPONSE_HEADERS if h in resp.headers}
+    return StreamingResponse(
+        iter_relay(resp),
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type", "application/octet-stream"),
+        headers=relay_headers,
+        background=BackgroundTask(resp.aclose),
+    )
+
 @app.get("/proxy/series/{study_id}/{series_id}/download")
-def proxy_download_series(study_id: str, series_id: str, format: str = "jpeg"):
-    backend_url = f"{MAIN_BACKEND_URL}/studies/{study_id}/series/{series_id}/export/file?format={format}"
-    resp = requests.get(backend_url, stream=True)
-    if resp.status_code != 200:
-        raise HTTPException(resp.status_code, f"Backend error: {resp.text}")
-    headers = {}
-    if 'content-disposition' in resp.headers:
-        headers["Content-Disposition"] = resp.headers["content-disposition"]
-    return StreamingResponse(resp.raw, media_type=resp.headers.get("content-type", "application/octet-stream"), headers=headers)
+async def proxy_download_series(request: Request, study_id: str, series_id: str):
+    return await relay_download(request, f"/studies/{study_id}/series/{series_id}/export/file")
 
 @app.get("/proxy/study/{study_id}/download")
-def proxy_download_study(study_id: str, format: str = "jpeg"):
-    backend_url = f"{MAIN_BACKEND_URL}/studies/{study_id}/export/file?format={format}"
-    resp = requests.get(backend_url, stream=True)
-    if resp.status_code != 200:
-        raise HTTPException(resp.status_code, f"Backend error: {resp.text}")
-    headers = {}
-    if 'content-disposition' in resp.headers:
-        headers["Content-Disposition"] = resp.headers["content-disposition"]
-    return StreamingResponse(resp.raw, media_type=resp.headers.get("content-type", "application/octet-stream"), headers=headers)
+async def proxy_download_study(request: Request, study_id: str):
+    return await relay_download(request, f"/studies/{study_id}/export/file")
+
+@app.get("/metrics")
+def proxy_metrics():
+    pool = getattr(backend_client._transport, "_pool", None)
+    connections = getattr(pool, "connections", [])
+    families = [
+        ("proxy_backend_connections", "gauge", "Pooled connections to the main backend.", [
+            ({"state": "active"}, sum(1 for c in connections if not c.is_idle())),
+            ({"state": "idle"}, sum(1 for c in connections if c.is_idle())),
+        ]),
+        ("proxy_backend_max_connections", "gauge", "Connection pool limit.", [({}, BACKEND_MAX_CONNECTIONS)]),
+    ]
+    return PlainTextResponse(render_metrics(families), media_type="text/plain; version=0.0.4")
 
 @app.options("/{rest_of_path:path}")
 async def preflight(rest_of_path: str):
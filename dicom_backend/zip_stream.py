@@ -0,0 +1,137 @@
+import hashlib
+import os
+import struct
+import time
+import zlib
+
+CHUNK_SIZE = 1024 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAGS = 0x08 | 0x800  # sizes in data descriptor, UTF-8 names
+
+def plan_stored_zip(files):
+    """
+    Stat (arcname, path) pairs into zip entries, skipping missing files.
+    (arcname, buffer, mtime) takes the entry from memory instead, such as a
+    memoryview into a packed series, which stays mapped while it is alive.
+    """
+    entries = []
+    for arcname, source, *mtime in files:
+        entry = {"arcname": arcname, "name": arcname.encode("utf-8")}
+        if isinstance(source, str):
+            try:
+                st = os.stat(source)
+            except OSError:
+                continue
+            entry.update(path=source, size=st.st_size, mtime=st.st_mtime)
+        else:
+            entry.update(data=source, size=len(source), mtime=mtime[0])
+        entries.append(entry)
+    return entries
+
+def _dos_datetime(mtime):
+    t = time.localtime(mtime)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+def _layout(entries):
+    offset = 0
+    offsets = []
+    for e in entries:
+        offsets.append(offset)
+        offset += 30 + len(e["name"]) + e["size"] + 16
+    cd_size = sum(46 + len(e["name"]) + (12 if off >= ZIP64_LIMIT else 0) for e, off in zip(entries, offsets))
+    zip64 = offset >= ZIP64_LIMIT or offset + cd_size >= ZIP64_LIMIT or len(entries) >= 0xFFFF
+    return offsets, offset, cd_size, zip64
+
+def stored_zip_size(entries):
+    """
+    Exact byte length of the archive iter_stored_zip will produce.
+    """
+    _, cd_offset, cd_size, zip64 = _layout(entries)
+    return cd_offset + cd_size + (56 + 20 if zip64 else 0) + 22
+
+def stored_zip_etag(entries):
+    """
+    Validator for the archive bytes; they depend only on names, sizes and mtimes.
+    """
+    h = hashlib.sha1()
+    for e in entries:
+        h.update(f"{e['arcname']}\0{e['size']}\0{e['mtime']}\n".encode("utf-8"))
+    return f'"{h.hexdigest()}"'
+
+def iter_byte_range(chunks, start, end):
+    """
+    Yield bytes start..end (inclusive) of a chunk stream. Earlier chunks are
+    still produced and dropped, since later CRCs depend on them.
+    """
+    pos = 0
+    for chunk in chunks:
+        n = len(chunk)
+        if pos + n > start:
+            yield chunk[max(start - pos, 0):end - pos + 1]
+        pos += n
+        if pos > end:
+            break
+
+def _iter_entry_data(e, chunk_size):
+    if "data" in e:
+        for start in range(0, e["size"], chunk_size):
+            yield bytes(e["data"][start:start + chunk_size])
+        return
+    remaining = e["size"]
+    with open(e["path"], "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                raise IOError(f"{e['path']} shrank while streaming")
+            remaining -= len(chunk)
+            yield chunk
+
+def iter_stored_zip(entries, chunk_size=CHUNK_SIZE):
+    """
+    Stream an uncompressed (ZIP_STORED) archive without temp files; memory
+    use is one chunk regardless of archive size. Files are read sequentially
+    and must not change size between plan_stored_zip and streaming.
+    """
+    offsets, cd_offset, cd_size, zip64 = _layout(entries)
+    central = []
+    for e, offset in zip(entries, offsets):
+        dos_time, dos_date = _dos_datetime(e["mtime"])
+        yield struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 20, ZIP_FLAGS, 0, dos_time, dos_date,
+            0, 0, 0, len(e["name"]), 0,
+        ) + e["name"]
+        crc = 0
+        for chunk in _iter_entry_data(e, chunk_size):
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+        yield struct.pack("<IIII", 0x08074B50, crc, e["size"], e["size"])
+
+        extra = b""
+        header_offset = offset
+        if offset >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQ", 0x0001, 8, offset)
+            header_offset = 0xFFFFFFFF
+        central.append(struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, 45, 45 if extra else 20, ZIP_FLAGS, 0,
+            dos_time, dos_date, crc, e["size"], e["size"], len(e["name"]), len(extra),
+            0, 0, 0, 0o100644 << 16, header_offset,
+        ) + e["name"] + extra)
+
+    yield b"".join(central)
+    count = len(entries)
+    if zip64:
+        zip64_offset = cd_offset + cd_size
+        yield struct.pack(
+            "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset,
+        )
+        yield struct.pack("<IIQI", 0x07064B50, 0, zip64_offset, 1)
+        yield struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(cd_size, 0xFFFFFFFF), min(cd_offset, 0xFFFFFFFF), 0,
+        )
+    else:
+        yield struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, cd_size, cd_offset, 0)
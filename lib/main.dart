@@ -11,6 +11,7 @@ import 'dart:math' as math;
 import 'dart:async';
 import 'package:archive/archive_io.dart';
 import 'package:cached_network_image/cached_network_image.dart';
+import 'package:flutter_cache_manager/flutter_cache_manager.dart';
 
 
 
@@ -33,6 +34,41 @@ String sanitizeName(String s, {int maxLen = 24}) {
   return cleaned;
 }
 
+// Slices requested per /images batch while warming a series
+const int prefetchBatchSize = 32;
+
+// Splits a multipart/related /images response into Content-ID -> JPEG bytes.
+// Parts are framed by their Content-Length, so image data is never scanned
+// for the boundary.
+Map<String, Uint8List> parseJpegBatch(Uint8List body) {
+  final parts = <String, Uint8List>{};
+  int pos = 0;
+  while (true) {
+    int end = -1;
+    for (int i = pos; i + 3 < body.length; ++i) {
+      if (body[i] == 13 && body[i + 1] == 10 && body[i + 2] == 13 && body[i + 3] == 10) {
+        end = i;
+        break;
+      }
+    }
+    if (end < 0) break;
+    final headers = <String, String>{};
+    for (final line in latin1.decode(body.sublist(pos, end)).split("\r\n")) {
+      final colon = line.indexOf(':');
+      if (colon > 0) {
+        headers[line.substring(0, colon).trim().toLowerCase()] = line.substring(colon + 1).trim();
+      }
+    }
+    final length = int.tryParse(headers['content-length'] ?? '');
+    final start = end + 4;
+    if (length == null || start + length > body.length) break;
+    final id = (headers['content-id'] ?? '').replaceAll(RegExp(r'^<|>$'), '');
+    parts[id] = Uint8List.sublistView(body, start, start + length);
+    pos = start + length + 2;
+  }
+  return parts;
+}
+
 
 class DicomViewerApp extends StatelessWidget {
   const DicomViewerApp({super.key});
@@ -77,13 +113,32 @@ class _MainNavigationState extends State<MainNavigation> {
     _fetchStudies();
   }
 
+  // /studies is paginated; fetch every page (X-Total-Count) so the list and
+  // the local search cover the whole catalog, not just the first page.
+  static const int _studiesPageSize = 500;
+
+  Future<http.Response?> _fetchAllStudyPages(
+      List<Map<String, dynamic>> studies) async {
+    http.Response? response;
+    for (int page = 1;; page++) {
+      response = await http.get(Uri.parse(
+          'http://127.0.0.1:8000/studies?page=$page&limit=$_studiesPageSize'));
+      if (response.statusCode != 200) return response;
+      final List data = json.decode(response.body);
+      studies.addAll(data.cast<Map<String, dynamic>>());
+      final total = int.tryParse(response.headers['x-total-count'] ?? '');
+      if (data.isEmpty || total == null || studies.length >= total) {
+        return response;
+      }
+    }
+  }
+
   Future<void> _fetchStudies() async {
     setState(() => _loadingStudies = true);
     try {
-      final response = await http.get(Uri.parse('http://127.0.0.1:8000/studies'));
-      if (response.statusCode == 200) {
-        final List data = json.decode(response.body);
-        List<Map<String, dynamic>> studies = data.cast<Map<String, dynamic>>();
+      final List<Map<String, dynamic>> studies = [];
+      final response = await _fetchAllStudyPages(studies);
+      if (response != null && response.statusCode == 200) {
         if (!_demoAdded && studies.every((s) => s['study_id'] != 'demo')) {
           studies.insert(
             0,
@@ -228,11 +283,23 @@ class _HomeScreenState extends State<HomeScreen> {
     });
   }
 
-  void _openViewer(Map<String, dynamic> study) {
+  Future<void> _openViewer(Map<String, dynamic> study) async {
+    // The study list only carries summaries; fetch series/images on open.
+    Map<String, dynamic> detail = study;
+    if (study['study_id'] != 'demo' && study['series'] == null) {
+      try {
+        final resp = await http.get(
+            Uri.parse('http://127.0.0.1:8000/studies/${study['study_id']}'));
+        if (resp.statusCode == 200) {
+          detail = json.decode(resp.body);
+        }
+      } catch (_) {}
+    }
+    if (!mounted) return;
     Navigator.push(
       context,
       MaterialPageRoute(
-        builder: (context) => ViewerScreen(study: study),
+        builder: (context) => ViewerScreen(study: detail),
       ),
     );
   }
@@ -499,7 +566,10 @@ class _UploadScreenState extends State<UploadScreen> {
     });
 
     try {
-      var uri = Uri.parse("$proxyBase/proxy/upload/");
+      // The proxy relays the body straight to the backend and pushes its
+      // byte counter over SSE while the request is in flight.
+      String taskId = DateTime.now().microsecondsSinceEpoch.toString();
+      var uri = Uri.parse("$proxyBase/proxy/upload/?task_id=$taskId");
       var request = http.MultipartRequest('POST', uri);
 
       for (var file in filesToUpload) {
@@ -512,34 +582,26 @@ class _UploadScreenState extends State<UploadScreen> {
           ),
         );
       }
-      var streamed = await request.send();
-      var response = await http.Response.fromStream(streamed);
+      var progressEvents = _watchUploadProgress(taskId);
+      http.Response response;
+      try {
+        var streamed = await request.send();
+        response = await http.Response.fromStream(streamed);
+      } finally {
+        progressEvents.close();
+      }
 
       if (response.statusCode == 200) {
         final respJson = json.decode(response.body);
-        if (respJson['task_id'] != null) {
-          String taskId = respJson['task_id'];
-          // Poll progress
-          while (true) {
-            await Future.delayed(const Duration(milliseconds: 700));
-            var progressResp = await http.get(Uri.parse("$proxyBase/proxy/progress/$taskId"));
-            var progressData = json.decode(progressResp.body);
-            double percent = (progressData['percent'] ?? 0.0).toDouble();
-            setState(() {
-              _uploadProgress = percent;
-            });
-            if ((progressData['status'] ?? "").startsWith("done") ||
-                (progressData['status'] ?? "").startsWith("error")) {
-              setState(() {
-                _status = progressData['status'] == "done" ? "Upload successful!" : "Upload failed: ${progressData['status']}";
-                _uploadProgress = 1.0;
-              });
-              if (widget.onNewStudy != null && progressData['status'] == "done") {
-                widget.onNewStudy!({});
-              }
-              break;
-            }
-          }
+        // The proxy only answers once the body has been relayed, so the
+        // response carries the final state.
+        final String taskStatus = respJson['status'] ?? "";
+        setState(() {
+          _status = taskStatus == "done" ? "Upload successful!" : "Upload failed: $taskStatus";
+          _uploadProgress = 1.0;
+        });
+        if (widget.onNewStudy != null && taskStatus == "done") {
+          widget.onNewStudy!({});
         }
       } else {
         setState(() {
@@ -562,6 +624,29 @@ class _UploadScreenState extends State<UploadScreen> {
     }
   }
 
+  http.Client _watchUploadProgress(String taskId) {
+    final client = http.Client();
+    () async {
+      try {
+        final request = http.Request('GET', Uri.parse("$proxyBase/proxy/progress/$taskId/events"));
+        request.headers['Accept'] = 'text/event-stream';
+        final response = await client.send(request);
+        await for (final line in response.stream.transform(utf8.decoder).transform(const LineSplitter())) {
+          if (!line.startsWith('data:')) continue;
+          final progressData = json.decode(line.substring(5));
+          if (mounted) {
+            setState(() {
+              _uploadProgress = (progressData['percent'] ?? 0.0).toDouble();
+            });
+          }
+        }
+      } catch (_) {
+        // Closed once the upload returns, or the proxy went away
+      }
+    }();
+    return client;
+  }
+
   Future<void> pickAndUploadZip() async {
     setState(() {
       _status = null;
@@ -594,7 +679,10 @@ class _UploadScreenState extends State<UploadScreen> {
     });
 
     try {
-      var uri = Uri.parse("$proxyBase/proxy/upload_zip/");
+      // The proxy relays the body straight to the backend and pushes its
+      // byte counter over SSE while the request is in flight.
+      String taskId = DateTime.now().microsecondsSinceEpoch.toString();
+      var uri = Uri.parse("$proxyBase/proxy/upload_zip/?task_id=$taskId");
       var request = http.MultipartRequest('POST', uri);
 
       int totalSize = zipFile.lengthSync();
@@ -608,34 +696,26 @@ class _UploadScreenState extends State<UploadScreen> {
         ),
       );
 
-      var streamed = await request.send();
-      var response = await http.Response.fromStream(streamed);
+      var progressEvents = _watchUploadProgress(taskId);
+      http.Response response;
+      try {
+        var streamed = await request.send();
+        response = await http.Response.fromStream(streamed);
+      } finally {
+        progressEvents.close();
+      }
 
       if (response.statusCode == 200) {
         final respJson = json.decode(response.body);
-        if (respJson['task_id'] != null) {
-          String taskId = respJson['task_id'];
-          // Poll progress
-          while (true) {
-            await Future.delayed(const Duration(milliseconds: 700));
-            var progressResp = await http.get(Uri.parse("$proxyBase/proxy/progress/$taskId"));
-            var progressData = json.decode(progressResp.body);
-            double percent = (progressData['percent'] ?? 0.0).toDouble();
-            setState(() {
-              _uploadProgress = percent;
-            });
-            if ((progressData['status'] ?? "").startsWith("done") ||
-                (progressData['status'] ?? "").startsWith("error")) {
-              setState(() {
-                _status = progressData['status'] == "done" ? "Upload successful!" : "Upload failed: ${progressData['status']}";
-                _uploadProgress = 1.0;
-              });
-              if (widget.onNewStudy != null && progressData['status'] == "done") {
-                widget.onNewStudy!({});
-              }
-              break;
-            }
-          }
+        // The proxy only answers once the body has been relayed, so the
+        // response carries the final state.
+        final String taskStatus = respJson['status'] ?? "";
+        setState(() {
+          _status = taskStatus == "done" ? "Upload successful!" : "Upload failed: $taskStatus";
+          _uploadProgress = 1.0;
+        });
+        if (widget.onNewStudy != null && taskStatus == "done") {
+          widget.onNewStudy!({});
         }
       } else {
         setState(() {
@@ -1350,13 +1430,30 @@ class _ViewerScreenState extends State<ViewerScreen> {
       });
       return;
     }
-    for (int i = 0; i < n; ++i) {
-      final img = _images[i];
-      final url =
-          "http://127.0.0.1:8000/studies/${widget.study['study_id']}/series/${_seriesList[_selectedSeries]['series_id']}/image/${img['image_id']}?format=jpeg";
-      await precacheImage(CachedNetworkImageProvider(url), context);
+    // One /images round trip per batch; each part is stored in the image
+    // cache under the per-slice URL the viewer requests, so scrolling hits
+    // the cache instead of the network.
+    final seriesBase =
+        "http://127.0.0.1:8000/studies/${widget.study['study_id']}/series/${_seriesList[_selectedSeries]['series_id']}";
+    final cache = DefaultCacheManager();
+    for (int start = 0; start < n; start += prefetchBatchSize) {
+      try {
+        final resp = await http.get(Uri.parse("$seriesBase/images?start=$start&count=$prefetchBatchSize"));
+        if (resp.statusCode == 200) {
+          final parts = parseJpegBatch(resp.bodyBytes);
+          for (final img in _images.skip(start).take(prefetchBatchSize)) {
+            final bytes = parts['${img['image_id']}'];
+            if (bytes == null) continue;
+            final url = "$seriesBase/image/${img['image_id']}?format=jpeg&rev=${img['revision'] ?? 0}";
+            await cache.putFile(url, bytes, fileExtension: 'jpg');
+          }
+        }
+      } catch (_) {
+        // Prefetch is best effort; the viewer still loads slices on demand
+      }
+      if (!mounted) return;
       setState(() {
-        _seriesLoadingProgress = (i + 1) / n;
+        _seriesLoadingProgress = math.min(start + prefetchBatchSize, n) / n;
       });
     }
     setState(() {
@@ -1797,17 +1894,43 @@ class _ViewerScreenState extends State<ViewerScreen> {
         }
 
         try {
-          final request = http.Request('GET', Uri.parse(url));
-          final response = await http.Client().send(request);
-          final contentLength = response.contentLength ?? 1;
-          int received = 0;
+          // Resume with Range/If-Range if the connection drops mid-export
+          final client = http.Client();
           List<int> bytes = [];
-          await for (var chunk in response.stream) {
-            bytes.addAll(chunk);
-            received += chunk.length;
-            setState(() {
-              _exportProgress = (received / contentLength).clamp(0.0, 1.0);
-            });
+          int contentLength = 1;
+          String? etag;
+          int retries = 0;
+          try {
+            while (true) {
+              final request = http.Request('GET', Uri.parse(url));
+              if (etag != null && bytes.isNotEmpty) {
+                request.headers['Range'] = 'bytes=${bytes.length}-';
+                request.headers['If-Range'] = etag;
+              }
+              try {
+                final response = await client.send(request);
+                if (response.statusCode == 200) {
+                  bytes = [];
+                  contentLength = response.contentLength ?? 1;
+                } else if (response.statusCode != 206) {
+                  throw Exception("HTTP ${response.statusCode}");
+                }
+                etag = response.headers['etag'];
+                await for (var chunk in response.stream) {
+                  bytes.addAll(chunk);
+                  setState(() {
+                    _exportProgress = (bytes.length / contentLength).clamp(0.0, 1.0);
+                  });
+                }
+                break;
+              } catch (e) {
+                if ((e is! http.ClientException && e is! IOException) || etag == null || ++retries > 3) {
+                  rethrow;
+                }
+              }
+            }
+          } finally {
+            client.close();
           }
           final zipBytes = bytes;
           final archive = ZipDecoder().decodeBytes(zipBytes);
@@ -1856,7 +1979,7 @@ class _ViewerScreenState extends State<ViewerScreen> {
     } else if (_images.isNotEmpty) {
       final currentImage = _images[_currentImageIndex];
       imageUrl =
-      "http://127.0.0.1:8000/studies/${widget.study['study_id']}/series/${_seriesList[_selectedSeries]['series_id']}/image/${currentImage['image_id']}?format=jpeg";
+      "http://127.0.0.1:8000/studies/${widget.study['study_id']}/series/${_seriesList[_selectedSeries]['series_id']}/image/${currentImage['image_id']}?format=jpeg&rev=${currentImage['revision'] ?? 0}";
     }
 
     Widget imageWidget = imageUrl.isEmpty